@@ -2,14 +2,23 @@ from flask import Flask, render_template, request, jsonify, session, send_file
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-import json
 import sys
 import argparse
+import faulthandler
+import logging
 from datetime import datetime, timedelta
+
+# 图片处理模块的逐个文件日志为DEBUG级别，默认只输出INFO及以上；
+# 需要在导入image_processor之前配置，否则导入时的警告不会输出
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+# 解码器等C扩展崩溃时输出所有线程的Python调用栈
+faulthandler.enable()
+
 from config import Config
 from image_processor import ImageProcessor
 import shutil
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
 app = Flask(__name__)
@@ -63,15 +72,29 @@ if len(sys.argv) > 1 and sys.argv[1] == '--rebuild-cache':
                 print(f"正在处理目录: {directory}")
                 images = image_processor.scan_directory(directory)  # 使用递归扫描
                 total = len(images)
-                for i, image in enumerate(images, 1):
+                
+                # 按目录批量提取元数据，每批图片的评分只需一条exiftool命令
+                image_processor.extract_metadata_batch([image['file_path'] for image in images])
+                
+                def rebuild_image_cache(image):
+                    """生成单张图片的缩略图和预览图，返回失败时的异常"""
                     try:
                         # 生成缩略图
                         image_processor.generate_thumbnail(image['file_path'])
                         # 生成预览图
                         image_processor.generate_preview(image['file_path'])
-                        print(f"进度: {i}/{total} - {image['metadata']['filename']}")
+                        return None
                     except Exception as e:
-                        print(f"处理失败 {image['metadata']['filename']}: {e}")
+                        return e
+                
+                # 多张图片并行处理，读文件、解码和编码可以相互重叠
+                with ThreadPoolExecutor(max_workers=image_processor.max_workers) as executor:
+                    results = executor.map(rebuild_image_cache, images)
+                    for i, (image, error) in enumerate(zip(images, results), 1):
+                        if error is None:
+                            print(f"进度: {i}/{total} - {image['metadata']['filename']}")
+                        else:
+                            print(f"处理失败 {image['metadata']['filename']}: {error}")
         print("缓存重新生成完成！")
     
     sys.exit(0)
@@ -216,6 +239,9 @@ def browse_directory():
     # 扫描当前目录获取图片（不递归）
     images = image_processor.scan_current_directory(directory)
     
+    # 后台预取同级目录列表，切换到相邻目录时更快
+    image_processor.prefetch_sibling_directories(directory)
+    
     # 排序
     if sort_by == 'name':
         images.sort(key=lambda x: x['metadata']['filename'], reverse=(sort_order == 'desc'))
@@ -383,24 +409,10 @@ def set_rating():
     if not file_accessible:
         return jsonify({'error': '无权访问此文件'}), 403
     
+    # set_windows_rating会同步更新元数据缓存
     success = image_processor.set_windows_rating(file_path, rating)
     
     if success:
-        # 更新缓存的元数据
-        cache_dir = image_processor.get_cache_dir(file_path)
-        file_hash = image_processor.get_file_hash(file_path)
-        metadata_path = os.path.join(cache_dir, f"meta_{file_hash}.json")
-        
-        try:
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                metadata['rating'] = rating
-                with open(metadata_path, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"更新元数据缓存失败: {e}")
-        
         return jsonify({'success': True})
     else:
         return jsonify({'error': '设置星级失败'}), 500
@@ -510,25 +522,9 @@ def delete_files():
             if delete_type == 'permanent':
                 # 永久删除文件
                 if os.path.isfile(file_path):
+                    # 先删除相关的缓存文件（缓存键依赖原文件的修改时间和大小）
+                    image_processor.remove_cached_files(file_path)
                     os.remove(file_path)
-                    # 同时删除相关的缓存文件
-                    cache_dir = image_processor.get_cache_dir(file_path)
-                    file_hash = image_processor.get_file_hash(file_path)
-                    
-                    # 删除缩略图缓存
-                    thumbnail_path = os.path.join(cache_dir, f"thumbnail_{file_hash}.jpg")
-                    if os.path.exists(thumbnail_path):
-                        os.remove(thumbnail_path)
-                    
-                    # 删除预览图缓存
-                    preview_path = os.path.join(cache_dir, f"preview_{file_hash}.jpg")
-                    if os.path.exists(preview_path):
-                        os.remove(preview_path)
-                    
-                    # 删除元数据缓存
-                    metadata_path = os.path.join(cache_dir, f"meta_{file_hash}.json")
-                    if os.path.exists(metadata_path):
-                        os.remove(metadata_path)
                     
                 success_count += 1
             else:
@@ -552,28 +548,12 @@ def delete_files():
                         target_path = os.path.join(recycle_dir, f"{file_name}_{timestamp}_{counter}{file_ext}")
                         counter += 1
                     
+                    # 先删除相关的缓存文件（缓存键依赖原文件的修改时间和大小）
+                    image_processor.remove_cached_files(file_path)
+                    
                     # 移动文件到回收站
                     shutil.move(file_path, target_path)
                     
-                    # 删除相关的缓存文件
-                    cache_dir = image_processor.get_cache_dir(file_path)
-                    file_hash = image_processor.get_file_hash(file_path)
-                    
-                    # 删除缩略图缓存
-                    thumbnail_path = os.path.join(cache_dir, f"thumbnail_{file_hash}.jpg")
-                    if os.path.exists(thumbnail_path):
-                        os.remove(thumbnail_path)
-                    
-                    # 删除预览图缓存
-                    preview_path = os.path.join(cache_dir, f"preview_{file_hash}.jpg")
-                    if os.path.exists(preview_path):
-                        os.remove(preview_path)
-                    
-                    # 删除元数据缓存
-                    metadata_path = os.path.join(cache_dir, f"meta_{file_hash}.json")
-                    if os.path.exists(metadata_path):
-                        os.remove(metadata_path)
-                    
                 success_count += 1
         except Exception as e:
             failed_files.append({
@@ -26,6 +26,8 @@ class Config:
             "image_directories": [],
             "thumbnail_size": [256, 256],
             "preview_max_size": 1920,
+            "cache_workers": 0,  # 缓存生成线程数，0表示按CPU核心数自动设置
+            "optimize_jpeg": False,  # 是否对缓存JPEG做Huffman优化（体积略小，编码耗时约翻倍）
             "supported_formats": [".jpg", ".jpeg", ".png", ".tiff", ".tif", ".bmp", ".raw", ".cr2", ".nef", ".arw", ".dng"],
             "server": {
                 "host": "0.0.0.0",
@@ -48,8 +50,10 @@ class Config:
     def save_config(self):
         """保存配置文件"""
         try:
+            # 先序列化再一次写入，序列化失败时不会截断原配置文件
+            data = json.dumps(self.config, indent=2, ensure_ascii=False)
             with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
+                f.write(data)
         except Exception as e:
             print(f"保存配置文件失败: {e}")
     
@@ -107,8 +111,9 @@ class Config:
     def save_config_baseline(self, baseline_config: Dict):
         """保存配置基准"""
         try:
+            data = json.dumps(baseline_config, indent=2, ensure_ascii=False)
             with open(self.baseline_file, 'w', encoding='utf-8') as f:
-                json.dump(baseline_config, f, indent=2, ensure_ascii=False)
+                f.write(data)
         except Exception as e:
             print(f"保存配置基准失败: {e}")
     
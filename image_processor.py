@@ -1,19 +1,30 @@
 import os
+import io
+import re
+import atexit
+import bisect
 import json
 import hashlib
+import functools
+import logging
+import mmap
 import shutil
-import os
 import tempfile
 import threading
-import queue
+import time
+import sqlite3
 import subprocess
 from pathlib import Path
-from PIL import Image, ExifTags, ImageDraw, ImageFont
-from PIL.ExifTags import TAGS
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
 import exifread
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, Iterator, List, Tuple, Optional
 from datetime import datetime
-from PIL import ImageOps
+
+logger = logging.getLogger(__name__)
+# 作为库使用且调用方未配置日志时不输出任何内容，由应用程序决定日志级别和输出位置
+logger.addHandler(logging.NullHandler())
 
 # 暂时禁用rawpy依赖，使用替代方法处理RAW文件
 RAWPY_AVAILABLE = False
@@ -25,179 +36,1514 @@ try:
     WIN32_AVAILABLE = True
 except ImportError:
     WIN32_AVAILABLE = False
-    print("警告: pywin32未安装，Windows星级评分功能将被禁用")
+    logger.warning("pywin32未安装，Windows星级评分功能将被禁用")
 
-# 使用exiftool实现的星级评分函数
-def get_rating(file_path: str) -> int:
-    """使用exiftool获取图片的星级评分"""
+# 尝试导入Windows属性系统评分模块，可用时读写评分不经过exiftool进程
+try:
+    import win_rating
+    WIN_PROPSYS_AVAILABLE = True
+except ImportError:
+    WIN_PROPSYS_AVAILABLE = False
+
+# 尝试导入pyexiv2，可用时在进程内读写XMP评分，不需要与exiftool进程通信
+try:
+    import pyexiv2
+    EXIV2_AVAILABLE = True
+except ImportError:
+    EXIV2_AVAILABLE = False
+
+# 尝试导入pyvips，可用时非RAW图片使用libvips缩放（SIMD加速、流式处理、释放GIL）
+try:
+    import pyvips
+    VIPS_AVAILABLE = True
+except (ImportError, OSError):
+    # 未安装pyvips或找不到libvips动态库时使用Pillow
+    VIPS_AVAILABLE = False
+
+# 尝试导入orjson，元数据缓存读写比标准库json快数倍
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 尝试导入xxhash，缓存键只用于区分文件，不需要加密哈希
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+class ExifToolDaemon:
+    """常驻的exiftool进程（-stay_open模式）
+    
+    进程在第一次调用时启动，之后每条命令通过标准输入发送，
+    不再为每个文件启动一次exiftool（Perl解释器启动需要几百毫秒）
+    """
+    
+    READY = '{ready}'
+    # -json输出的起始行，以及写入命令输出中的更新文件数
+    JSON_START = re.compile(r'^\[', re.MULTILINE)
+    UPDATED_COUNT = re.compile(r'(\d+) image files? updated')
+    
+    def __init__(self, executable: str = 'exiftool'):
+        self.executable = executable
+        self._process = None
+        self._unavailable = False
+        self._lock = threading.Lock()
+    
+    def _ensure_process(self) -> subprocess.Popen:
+        """返回正在运行的exiftool进程，未启动或已退出时重新启动"""
+        if self._process is not None and self._process.poll() is None:
+            return self._process
+        if self._unavailable:
+            raise FileNotFoundError(f"未找到exiftool: {self.executable}")
+        try:
+            # 错误信息合并到标准输出，与命令结果一起在{ready}之前读出
+            self._process = subprocess.Popen(
+                [self.executable, '-stay_open', 'True', '-@', '-'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                encoding='utf-8', errors='replace'
+            )
+        except FileNotFoundError:
+            # 没有安装exiftool时不再反复尝试启动
+            self._unavailable = True
+            raise
+        return self._process
+    
+    def _kill(self):
+        """通信出错时结束进程，下次调用会重新启动"""
+        process, self._process = self._process, None
+        if process is not None:
+            process.kill()
+            process.wait()
+    
+    def execute(self, *args: str) -> str:
+        """执行一条exiftool命令，返回{ready}之前的全部输出
+        
+        文件名以UTF-8传给exiftool，支持中文路径
+        """
+        with self._lock:
+            process = self._ensure_process()
+            try:
+                process.stdin.write('\n'.join(('-charset', 'filename=utf8') + args) + '\n-execute\n')
+                process.stdin.flush()
+                lines = []
+                while True:
+                    line = process.stdout.readline()
+                    if not line:
+                        raise OSError("exiftool进程意外退出")
+                    if line.rstrip('\r\n') == self.READY:
+                        return ''.join(lines)
+                    lines.append(line)
+            except (OSError, ValueError):
+                self._kill()
+                raise
+    
+    def read_ratings(self, file_paths: List[str]) -> Dict[str, int]:
+        """用一条命令读取多个文件的星级评分，没有评分或读取失败的文件为0"""
+        ratings = {path: 0 for path in file_paths}
+        if not file_paths:
+            return ratings
+        
+        # 评分位于文件头部的XMP/EXIF中，-fast2跳过MakerNotes和文件尾部数据的解析
+        output = self.execute('-fast2', '-json', '-Rating', *file_paths)
+        match = self.JSON_START.search(output)
+        if match is None:
+            logger.warning("读取评级失败: %s", output.strip())
+            return ratings
+        
+        # exiftool输出的SourceFile可能改用/分隔，按规范化后的路径对应回调用方传入的路径
+        paths_by_key = {os.path.normcase(os.path.normpath(path)): path for path in file_paths}
+        items, _ = json.JSONDecoder().raw_decode(output, match.start())
+        for item in items:
+            source = os.path.normcase(os.path.normpath(item.get('SourceFile', '')))
+            path = paths_by_key.get(source)
+            if path is not None:
+                ratings[path] = parse_rating(item.get('Rating'))
+        return ratings
+    
+    def write_rating(self, file_path: str, stars: int) -> bool:
+        """写入星级评分，返回exiftool是否报告文件已更新"""
+        return self.write_ratings({file_path: stars}) == 1
+    
+    def write_ratings(self, ratings: Dict[str, int]) -> int:
+        """批量写入星级评分，评分相同的文件用一条命令写入
+        
+        Args:
+            ratings: {文件路径: 0-5星}
+        
+        Returns:
+            int: exiftool报告已更新的文件数
+        """
+        paths_by_stars = defaultdict(list)
+        for path, stars in ratings.items():
+            paths_by_stars[stars].append(path)
+        
+        updated = 0
+        for stars, paths in paths_by_stars.items():
+            output = self.execute(f'-Rating={stars}', '-overwrite_original', *paths)
+            match = self.UPDATED_COUNT.search(output)
+            count = int(match.group(1)) if match is not None else 0
+            if count < len(paths):
+                logger.warning("写入评级失败: %s", output.strip())
+            updated += count
+        return updated
+    
+    def close(self):
+        """通知exiftool退出"""
+        with self._lock:
+            process, self._process = self._process, None
+            if process is None:
+                return
+            try:
+                process.stdin.write('-stay_open\nFalse\n')
+                process.stdin.flush()
+                process.wait(timeout=5)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                process.kill()
+                process.wait()
+
+def parse_rating(value) -> int:
+    """把exiftool返回的评分值转换为0-5的整数"""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return 0
+
+# 所有评分读写共用一个exiftool进程，程序退出时关闭
+_exiftool = ExifToolDaemon()
+atexit.register(_exiftool.close)
+
+# 内存中保留的目录列表和无图片目录树的数量上限，超过时丢弃最久未使用的
+DIR_CACHE_SIZE = 4096
+# 目录列表和无图片目录树的有效秒数。FAT/exFAT存储卡和SMB共享上目录修改时间不可靠，
+# 超过该时间即使修改时间未变也重新读取
+DIR_CACHE_TTL = 30.0
+
+# 大批量读取评分时同时使用的exiftool进程数，解析在各进程中进行，线程只负责收发
+EXIFTOOL_PROCESSES = max(1, min(os.cpu_count() or 1, 4))
+# 待读取的文件数达到该值时才分片并行读取，少量文件用一个进程更快
+PARALLEL_RATING_MIN = 64
+
+# 并行读取用的进程组，第一个就是共用的_exiftool，其余进程在第一次并行读取时才启动
+_exiftool_pool = [_exiftool] + [ExifToolDaemon() for _ in range(EXIFTOOL_PROCESSES - 1)]
+for _daemon in _exiftool_pool[1:]:
+    atexit.register(_daemon.close)
+
+def get_ratings_parallel(file_paths: List[str], workers: Optional[int] = None) -> Dict[str, int]:
+    """把文件分片，由多个常驻exiftool进程同时读取评分
+    
+    Args:
+        file_paths: 图片文件路径
+        workers: 使用的进程数，默认EXIFTOOL_PROCESSES
+    """
+    file_paths = [str(path) for path in file_paths]
+    workers = min(workers or EXIFTOOL_PROCESSES, len(_exiftool_pool), len(file_paths))
+    if workers <= 1:
+        return _exiftool.read_ratings(file_paths)
+    
+    chunk_size = -(-len(file_paths) // workers)
+    chunks = [file_paths[start:start + chunk_size] for start in range(0, len(file_paths), chunk_size)]
+    ratings = {}
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        for chunk_ratings in pool.map(ExifToolDaemon.read_ratings, _exiftool_pool, chunks):
+            ratings.update(chunk_ratings)
+    return ratings
+
+# pyexiv2的Image对象不保证线程安全，评分读写逐个进行
+_exiv2_lock = threading.Lock()
+
+def _read_rating_exiv2(file_path: str) -> Optional[int]:
+    """用pyexiv2读取XMP评分
+    
+    没有XMP评分（可能只写在EXIF中）、libexiv2不支持该格式或读取失败时返回None，由调用方改用exiftool
+    """
     try:
-        result = subprocess.run(
-            ["exiftool", "-Rating", "-s3", str(file_path)],
-            capture_output=True, text=True, encoding="mbcs", errors="ignore"
-        )
-        if result.returncode != 0:
-            print(f"读取评级失败: {result.stderr.strip()}")
-            return 0
-        rating_str = result.stdout.strip()
-        return int(rating_str) if rating_str.isdigit() else 0
+        with _exiv2_lock, pyexiv2.Image(file_path) as image:
+            xmp = image.read_xmp()
+    except Exception as e:
+        logger.debug("pyexiv2读取评分失败 %s: %s", file_path, e)
+        return None
+    value = xmp.get('Xmp.xmp.Rating')
+    if value is None:
+        return None
+    return max(0, min(5, parse_rating(value)))
+
+def _write_rating_exiv2(file_path: str, stars: int) -> bool:
+    """用pyexiv2写入XMP评分（与exiftool的-Rating相同的标签），失败时返回False"""
+    try:
+        with _exiv2_lock, pyexiv2.Image(file_path) as image:
+            image.modify_xmp({'Xmp.xmp.Rating': str(stars)})
+        return True
     except Exception as e:
-        print(f"获取星级评分出错: {e}")
-        return 0
+        logger.debug("pyexiv2写入评分失败 %s: %s", file_path, e)
+        return False
+
+# 星级评分函数：依次尝试Windows属性系统、pyexiv2和exiftool
+def get_rating(file_path: str) -> int:
+    """获取图片的星级评分"""
+    file_path = str(file_path)
+    return get_ratings([file_path])[file_path]
+
+def get_ratings(file_paths: List[str]) -> Dict[str, int]:
+    """获取多个图片的星级评分
+    
+    Windows上先通过属性系统读取，其余文件用pyexiv2在进程内读取，
+    两者都无法读取的格式再用一条exiftool命令读取
+    """
+    file_paths = [str(path) for path in file_paths]
+    ratings = {}
+    if WIN_PROPSYS_AVAILABLE:
+        for path in file_paths:
+            stars = win_rating.read_rating(path)
+            if stars is not None:
+                ratings[path] = stars
+    if EXIV2_AVAILABLE:
+        for path in file_paths:
+            if path not in ratings:
+                stars = _read_rating_exiv2(path)
+                if stars is not None:
+                    ratings[path] = stars
+    remaining = [path for path in file_paths if path not in ratings]
+    if remaining:
+        try:
+            if len(remaining) >= PARALLEL_RATING_MIN:
+                ratings.update(get_ratings_parallel(remaining))
+            else:
+                ratings.update(_exiftool.read_ratings(remaining))
+        except Exception as e:
+            logger.warning("获取星级评分出错: %s", e)
+            ratings.update((path, 0) for path in remaining)
+    return ratings
 
 def set_rating(file_path: str, stars: int) -> bool:
-    """使用exiftool设置图片的星级评分"""
+    """设置图片的星级评分，依次尝试Windows属性系统、pyexiv2，都失败时使用exiftool"""
     try:
         if stars < 0 or stars > 5:
-            print(f"错误: 无效的星级评分 (必须是0-5之间的整数) - {stars}")
+            logger.warning("无效的星级评分 (必须是0-5之间的整数) - %s", stars)
             return False
         
         if not os.path.exists(file_path):
-            print(f"错误: 文件不存在 - {file_path}")
+            logger.warning("文件不存在 - %s", file_path)
             return False
         
-        result = subprocess.run(
-            ["exiftool", f"-Rating={stars}", "-overwrite_original", str(file_path)],
-            capture_output=True, text=True, encoding="mbcs", errors="ignore"
-        )
-        if result.returncode != 0:
-            print(f"写入评级失败: {result.stderr.strip()}")
+        if ((WIN_PROPSYS_AVAILABLE and win_rating.write_rating(str(file_path), stars))
+                or (EXIV2_AVAILABLE and _write_rating_exiv2(str(file_path), stars))):
+            logger.debug("成功设置评分: %s星 到文件: %s", stars, file_path)
+            return True
+        
+        if not _exiftool.write_rating(str(file_path), stars):
             return False
         
-        print(f"成功设置评分: {stars}星 到文件: {file_path}")
+        logger.debug("成功设置评分: %s星 到文件: %s", stars, file_path)
         return True
     except Exception as e:
-        print(f"设置评分失败: {e}")
+        logger.warning("设置评分失败: %s", e)
         return False
 
+# 扩展名角色，同时作为分组元组中的下标
+ROLE_JPG = 0
+ROLE_RAW = 1
+ROLE_OTHER = 2
+
+# RAW占位图的边长，以及依次尝试的可显示中文的字体（Windows、Linux常见字体）
+PLACEHOLDER_SIZE = 300
+PLACEHOLDER_FONTS = ('msyh.ttc', 'simhei.ttf', 'simsun.ttc', 'NotoSansCJK-Regular.ttc', 'wqy-microhei.ttc')
+
+@functools.lru_cache(maxsize=None)
+def raw_placeholder() -> Image.Image:
+    """绘制无法提取预览的RAW文件使用的灰色占位图，首次调用时绘制一次，调用方使用副本
+    
+    Pillow的默认位图字体不包含中文字符，找不到中文字体时只显示"RAW"
+    """
+    image = Image.new('RGB', (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), color='gray')
+    draw = ImageDraw.Draw(image)
+    text, font = "RAW\n文件", None
+    for font_name in PLACEHOLDER_FONTS:
+        try:
+            font = ImageFont.truetype(font_name, 36)
+            break
+        except OSError:
+            continue
+    if font is None:
+        text, font = "RAW", ImageFont.load_default()
+    tb = draw.multiline_textbbox((0, 0), text, font=font, align='center')
+    position = ((PLACEHOLDER_SIZE - (tb[2] - tb[0])) // 2 - tb[0],
+                (PLACEHOLDER_SIZE - (tb[3] - tb[1])) // 2 - tb[1])
+    draw.multiline_text(position, text, fill='white', font=font, align='center')
+    return image
+
+# RAW格式扩展名，包括Canon的CR3格式
+RAW_EXTS = frozenset(['.raw', '.cr2', '.cr3', '.nef', '.arw', '.dng', '.orf', '.rw2',
+                      '.crw', '.mrw', '.pef', '.raf', '.sr2', '.srf', '.x3f',
+                      '.tif', '.tiff', '.dcr', '.kdc', '.mos', '.erf'])
+
+def build_ext_roles(supported_exts, raw_exts) -> Dict[str, int]:
+    """生成 {扩展名: 角色} 映射，只包含支持的格式"""
+    ext_roles = {}
+    for ext in supported_exts:
+        ext = ext.lower()
+        if ext in ('.jpg', '.jpeg'):
+            ext_roles[ext] = ROLE_JPG
+        elif ext in raw_exts:
+            ext_roles[ext] = ROLE_RAW
+        else:
+            ext_roles[ext] = ROLE_OTHER
+    return ext_roles
+
+def classify_image_names(file_names: List[str], ext_roles: Dict[str, int]) -> List[Tuple[str, bool, bool]]:
+    """对同一目录下的文件名分类并按文件名（不含扩展名）分组
+    
+    只做字符串和字典运算，不访问文件系统，路径由调用方拼接
+    
+    Args:
+        file_names: 文件名列表
+        ext_roles: build_ext_roles生成的扩展名角色映射
+    
+    Returns:
+        List[Tuple[str, bool, bool]]: (显示文件名, 是否有RAW, 是否有JPG) 列表
+    """
+    groups = defaultdict(lambda: ([], [], []))  # (JPG, RAW, 其他格式)
+    for file_name in file_names:
+        # 直接截取扩展名，避免每个文件调用os.path.splitext
+        dot = file_name.rfind('.')
+        # 一次字典查找同时完成格式过滤和分类
+        role = ext_roles.get(file_name[dot:].lower()) if dot > 0 else None
+        if role is None:
+            continue
+        groups[file_name[:dot].lower()][role].append(file_name)
+    
+    results = []
+    for jpg_names, raw_names, other_names in groups.values():
+        if jpg_names:
+            # 有JPG时优先显示JPG，同名的RAW和其他格式不再单独显示
+            has_raw = bool(raw_names)
+            results.extend((name, has_raw, True) for name in jpg_names)
+        else:
+            results.extend((name, True, False) for name in raw_names)
+            results.extend((name, False, False) for name in other_names)
+    return results
+
+# 图片目录下存放缓存文件的隐藏文件夹名
+CACHE_DIR_NAME = '.album_cache'
+
+def relative_path(path: str, directory: str) -> str:
+    """计算path相对directory的路径
+    
+    扫描得到的路径都由directory拼接而来，直接去掉前缀即可，
+    只有前缀不匹配时才使用需要规范化两个路径的os.path.relpath
+    """
+    prefix = directory if directory.endswith(os.sep) else directory + os.sep
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return os.path.relpath(path, directory)
+
+def walk_folders(root: str) -> Iterator[Tuple[str, Dict[str, os.DirEntry], bool]]:
+    """用scandir自上而下遍历目录树，跳过以.开头的隐藏文件和文件夹
+    
+    与os.walk相比，每个条目的类型直接取自DirEntry，不需要额外stat；
+    隐藏文件夹（包括缓存文件夹）不会进入。无法读取的文件夹会被跳过
+    
+    Yields:
+        Tuple[str, Dict[str, os.DirEntry], bool]: (文件夹路径, {非隐藏文件名: DirEntry}, 是否包含缓存文件夹)，
+        调用方可以直接用DirEntry.stat()，Windows上不需要额外的系统调用
+    """
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        file_entries = {}
+        sub_dirs = []
+        has_cache_dir = False
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    name = entry.name
+                    if name.startswith('.'):
+                        if name == CACHE_DIR_NAME:
+                            has_cache_dir = True
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if not is_dir:
+                        file_entries[name] = entry
+                    elif not entry.is_symlink():
+                        # 与os.walk默认行为一致，不进入符号链接指向的文件夹
+                        sub_dirs.append(entry.path)
+        except OSError:
+            continue
+        yield folder, file_entries, has_cache_dir
+        # 倒序入栈，保持与os.walk相同的遍历顺序
+        stack.extend(reversed(sub_dirs))
+
+def dumps_json(obj) -> bytes:
+    """把对象编码为紧凑的UTF-8 JSON字节串（不转义中文、不缩进），可用时使用orjson编码"""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson不支持的类型（如超出64位的整数）交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def loads_json(data: bytes):
+    """解析UTF-8 JSON字节串，可用时使用orjson解析"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+def load_json_file(path: str):
+    """读取JSON文件"""
+    with open(path, 'rb') as f:
+        return loads_json(f.read())
+
+# 需要保存的EXIF字段 {PIL标签ID: 字段名}，字段名与前端显示和按拍摄时间排序使用的名称一致
+# 0x010F-0x0132位于IFD0，其余位于Exif子IFD
+PIL_EXIF_TAGS = {
+    0x010F: 'Make',
+    0x0110: 'Model',
+    0x0112: 'Orientation',
+    0x0132: 'DateTime',
+    0x829A: 'ExposureTime',
+    0x829D: 'FNumber',
+    0x8827: 'ISOSpeedRatings',
+    0x9003: 'DateTimeOriginal',
+    0x9209: 'Flash',
+    0x920A: 'FocalLength',
+    0xA434: 'LensModel',
+}
+# Exif子IFD的指针标签
+EXIF_IFD_POINTER = 0x8769
+
+# EXIF方向标签及各方向值对应的转置操作（与ImageOps.exif_transpose一致）
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# 会携带EXIF方向信息的图片格式，其他格式（如PNG）读取EXIF需要扫描整个文件且通常没有方向信息
+ORIENTATION_FORMATS = frozenset(['JPEG', 'MPO', 'TIFF', 'WEBP', 'HEIF', 'HEIC'])
+
+# exifread标签名与保存字段名的对应关系，RAW文件的EXIF也使用与PIL相同的字段名
+RAW_EXIF_TAGS = {
+    'Image Make': 'Make',
+    'Image Model': 'Model',
+    'Image Orientation': 'Orientation',
+    'Image DateTime': 'DateTime',
+    'EXIF ExposureTime': 'ExposureTime',
+    'EXIF FNumber': 'FNumber',
+    'EXIF ISOSpeedRatings': 'ISOSpeedRatings',
+    'EXIF DateTimeOriginal': 'DateTimeOriginal',
+    'EXIF Flash': 'Flash',
+    'EXIF FocalLength': 'FocalLength',
+    'EXIF LensModel': 'LensModel',
+}
+
+# 保存的EXIF值最大长度，超出部分截断
+EXIF_VALUE_MAX_LENGTH = 500
+
+def exif_value_text(value) -> str:
+    """把EXIF值转换为保存用的字符串，过长的值在转换前先截断
+    
+    exifread的标签直接使用已生成的printable；PIL的bytes/元组值先切片再转换，
+    不会为了丢弃大部分内容而先生成完整的字符串
+    """
+    truncated = False
+    if hasattr(value, 'printable'):
+        text = value.printable
+    elif isinstance(value, (bytes, tuple, list)) and len(value) > EXIF_VALUE_MAX_LENGTH:
+        text = str(value[:EXIF_VALUE_MAX_LENGTH])
+        truncated = True
+    else:
+        text = str(value)
+    if len(text) > EXIF_VALUE_MAX_LENGTH:
+        text = text[:EXIF_VALUE_MAX_LENGTH]
+        truncated = True
+    if truncated:
+        text += "... [截断显示]"
+    return text
+
+# 每个缓存目录一个元数据数据库，代替每张图片一个meta_{hash}.json
+META_DB_NAME = 'index.sqlite'
+# 同时保持打开的数据库连接数上限，超过时关闭最早打开的连接
+META_DB_MAX_CONNECTIONS = 64
+# 扫描目录时批量读取元数据，每批文件数不超过SQLite的参数个数上限
+META_BATCH_SIZE = 256
+# 元数据数据库的结构版本，低于该版本的数据库在打开时升级（见_upgrade_meta_db）
+META_DB_VERSION = 1
+# meta表以(缓存键, 文件名)为主键：缓存键只由内容决定，同一目录中内容相同的文件各有一条记录
+META_TABLE_SQL = ('CREATE TABLE IF NOT EXISTS meta ('
+                  'hash TEXT, filename TEXT, size INTEGER, mtime REAL, rating INTEGER, data BLOB, '
+                  'PRIMARY KEY (hash, filename))')
+# 元数据中单独成列的字段，其余字段（exif、is_raw等）编码为JSON存入data列
+META_COLUMNS = ('filename', 'file_size', 'modified_time', 'rating')
+
+def metadata_to_row(file_hash: str, metadata: Dict) -> Tuple:
+    """把元数据字典转换为meta表的一行"""
+    extra = {key: value for key, value in metadata.items() if key not in META_COLUMNS}
+    return (file_hash, metadata.get('filename'), metadata.get('file_size'),
+            metadata.get('modified_time'), metadata.get('rating', 0), dumps_json(extra))
+
+def row_to_metadata(row: Tuple) -> Dict:
+    """把meta表的一行（不含hash列）还原为元数据字典"""
+    metadata = dict(zip(META_COLUMNS, row[:4]))
+    metadata.update(loads_json(row[4]))
+    return metadata
+
+def metadata_matches_stat(metadata: Dict, file_path: str, stat: os.stat_result) -> bool:
+    """缓存的元数据记录的文件名、大小和修改时间是否与当前文件一致"""
+    return (metadata.get('filename') == os.path.basename(file_path)
+            and metadata.get('file_size') == stat.st_size
+            and metadata.get('modified_time') == stat.st_mtime)
+
+# 计算完整内容哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1 << 20
+# 缓存键只读取文件开头和结尾各这么多字节，RAW文件不必整个读入
+HASH_SAMPLE_SIZE = 64 * 1024
+# 内存中保留的缓存键数量上限，超过时丢弃最早记录的
+HASH_CACHE_SIZE = 65536
+# 内存中保留的元数据数量上限，超过时丢弃最久未使用的
+META_CACHE_SIZE = 4096
+# 评分变化后延迟这么多秒再写入元数据数据库，连续点击星级时只写入最后一次
+RATING_WRITE_DELAY = 0.3
+
+def legacy_cache_key(file_path: str, mtime: float, size: int) -> str:
+    """旧版本由文件路径、修改时间和大小计算的缓存键，只用于迁移旧缓存
+    
+    描述的是已写入磁盘的旧格式，无论是否安装xxhash都使用MD5
+    """
+    return hashlib.md5(f"{file_path}_{mtime}_{size}".encode()).hexdigest()
+
+def _new_digest():
+    """创建内容哈希对象：安装了xxhash时使用xxh3_64，否则使用blake2b"""
+    return xxhash.xxh3_64() if XXHASH_AVAILABLE else hashlib.blake2b(digest_size=16)
+
+def compute_content_key(file_path: str, size: int) -> str:
+    """按文件大小和开头、结尾各HASH_SAMPLE_SIZE字节计算缓存键，与路径和修改时间无关
+    
+    图片的EXIF/XMP（包括评分）在文件开头，重新编码会改变大小和结尾，
+    抽样足以区分同一目录中的图片，每个文件最多读取128KB
+    """
+    digest = _new_digest()
+    digest.update(size.to_bytes(8, 'little'))
+    with open(file_path, 'rb') as f:
+        if size <= 2 * HASH_SAMPLE_SIZE:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(HASH_SAMPLE_SIZE))
+            f.seek(-HASH_SAMPLE_SIZE, os.SEEK_END)
+            digest.update(f.read(HASH_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+def fallback_cache_key(file_path: str, stat: os.stat_result) -> str:
+    """文件内容暂时无法读取（被占用、无权限、刚被删除）时使用的缓存键，只由路径、修改时间和大小决定"""
+    digest = _new_digest()
+    digest.update(f"{file_path}_{stat.st_mtime_ns}_{stat.st_size}".encode())
+    return digest.hexdigest()
+
+def hash_file_content(file_path: str) -> str:
+    """读取整个文件计算内容哈希，用于确认文件完全相同"""
+    digest = _new_digest()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_atomically(output_path: str, save: Callable[[str], None]):
+    """先写入同目录下的临时文件，再用os.replace原子替换为目标文件
+    
+    两个工作线程同时生成同一缓存文件或写入中途中断时，不会留下不完整的文件
+    
+    Args:
+        output_path: 目标文件路径
+        save: 把内容写入给定路径的函数
+    """
+    root, ext = os.path.splitext(output_path)
+    # 保留扩展名，按扩展名判断格式的写入函数也能使用临时文件
+    temp_path = f"{root}.tmp{os.getpid()}_{threading.get_ident()}{ext}"
+    try:
+        save(temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def find_all_markers(data, marker: bytes) -> List[int]:
+    """返回marker在数据中出现的所有位置（升序）"""
+    positions = []
+    pos = data.find(marker)
+    while pos != -1:
+        positions.append(pos)
+        pos = data.find(marker, pos + 1)
+    return positions
+
+def find_largest_embedded_jpeg(data) -> Optional[Tuple[int, int]]:
+    """在RAW文件数据中查找最大的嵌入JPEG
+    
+    SOI(FFD8)和EOI(FFD9)标记各扫描一遍，每个SOI用二分查找匹配其后的第一个EOI，
+    不再为每个SOI重新向后搜索
+    
+    Args:
+        data: bytes或mmap等支持find和切片的对象
+    
+    Returns:
+        Optional[Tuple[int, int]]: (起始位置, 结束位置)，结束位置不包含在内；没有找到时返回None
+    """
+    eoi_positions = find_all_markers(data, b'\xff\xd9')
+    if not eoi_positions:
+        return None
+    
+    best_span = None
+    best_size = 0
+    for start in find_all_markers(data, b'\xff\xd8'):
+        index = bisect.bisect_left(eoi_positions, start)
+        if index == len(eoi_positions):
+            # SOI按升序排列，之后的SOI也不会再有匹配的EOI
+            break
+        end = eoi_positions[index] + 2
+        if end - start > best_size:
+            best_size = end - start
+            best_span = (start, end)
+    return best_span
+
+# 排队等待的普通缓存生成任务数上限，浏览大量目录时丢弃最早排队的任务
+TASK_QUEUE_LIMIT = 20000
+# 目录浏览时缩略图和元数据任务按此数量分段交替排队，前几张缩略图不必等待整个目录的元数据提取
+TASK_INTERLEAVE_SIZE = 64
+
+class _TaskChannel:
+    """缓存生成任务通道
+    
+    高优先级任务（用户点击查看的图片）和普通任务（目录浏览时的批量生成）分别排队，
+    工作线程在条件变量上阻塞等待，不再定时轮询。普通任务有数量上限，
+    超出时丢弃最早排队的任务（通常属于用户早已离开的目录），内存占用不随图库大小增长
+    """
+    
+    def __init__(self, low_limit: int = 0):
+        """
+        Args:
+            low_limit: 普通任务的数量上限，0表示不限制
+        """
+        self._high = deque()
+        self._low = deque()
+        self._low_limit = low_limit
+        self._cond = threading.Condition()
+    
+    def _evict_low(self) -> List[Dict]:
+        """丢弃超出上限的最早的普通任务并返回它们，调用方需持有_cond"""
+        evicted = []
+        if self._low_limit:
+            while len(self._low) > self._low_limit:
+                evicted.append(self._low.popleft())
+        return evicted
+    
+    def put(self, task: Optional[Dict], high_priority: bool = False) -> List[Dict]:
+        """添加任务并唤醒等待的工作线程，返回因超出上限被丢弃的普通任务"""
+        with self._cond:
+            if high_priority:
+                self._high.append(task)
+                self._cond.notify()
+            else:
+                # 优先线程只处理优先任务，notify()可能只唤醒它而让普通任务无人处理
+                self._low.append(task)
+                self._cond.notify_all()
+            return self._evict_low()
+    
+    def put_many(self, tasks: List[Dict], high_priority: bool = False) -> List[Dict]:
+        """一次加锁添加多个任务，并唤醒所有等待的工作线程，返回因超出上限被丢弃的普通任务"""
+        if not tasks:
+            return []
+        with self._cond:
+            (self._high if high_priority else self._low).extend(tasks)
+            self._cond.notify_all()
+            return self._evict_low()
+    
+    def get(self, high_only: bool = False) -> Optional[Dict]:
+        """取出下一个任务，优先返回高优先级任务，没有任务时阻塞等待
+        
+        Args:
+            high_only: 只取高优先级任务（专用于用户请求的工作线程）
+        """
+        with self._cond:
+            while not self._high and (high_only or not self._low):
+                self._cond.wait()
+            if self._high:
+                return self._high.popleft()
+            return self._low.popleft()
+    
+    def take_low_run(self, task_type: str, limit: int) -> List[Dict]:
+        """从普通通道队首连续取出最多limit个同类任务，不等待
+        
+        目录浏览时同类任务是成批连续放入的，工作线程可以合并处理
+        """
+        tasks = []
+        with self._cond:
+            while len(tasks) < limit and self._low and self._low[0]['type'] == task_type:
+                tasks.append(self._low.popleft())
+        return tasks
+    
+    def close(self, worker_count: int):
+        """为每个工作线程放入结束信号（None），排在未处理的普通任务之前"""
+        with self._cond:
+            self._high.extend([None] * worker_count)
+            self._cond.notify_all()
+
 class ImageProcessor:
     def __init__(self, config):
         self.config = config
         # 不再使用统一的cache目录，改为在图片原目录下生成隐藏文件夹
         
+        # 预先计算扩展名角色映射，扫描时每个文件只需一次字典查找
+        self._ext_roles = build_ext_roles(self.config.config['supported_formats'], RAW_EXTS)
+
+        # 各缓存目录中已存在的缓存文件名 {缓存目录: (目录修改时间ns, 文件名集合)}，
+        # 目录修改时间不变时只查集合，变化（外部删除或添加文件）时重新scandir
+        self._cache_listing = {}
+        # 本进程中已创建过的缓存目录
+        self._created_cache_dirs = set()
+        # 无法创建缓存目录（如只读文件夹）的目录，这些文件夹照常浏览，只是不生成缓存
+        self._unwritable_cache_dirs = set()
+        # 各缓存目录的元数据数据库连接，所有数据库操作由_meta_db_lock串行化
+        self._meta_connections = {}
+        # 被外部删除后重新创建的缓存目录，其中已打开的数据库连接指向已删除的文件，下次使用时重新打开
+        self._stale_meta_dirs = set()
+        self._meta_db_lock = threading.Lock()
+        # 目录列表缓存 {目录: (读取时间, (修改时间ns, 文件名列表, 子目录名列表))}，
+        # 目录修改时间变化或超过DIR_CACHE_TTL后重新扫描，按使用顺序排列，由_dir_cache_lock保护
+        self._dir_listing_cache = OrderedDict()
+        # 已计算的缓存键 {(文件路径, 修改时间ns, 大小): 缓存键}，按使用顺序排列，由_hash_cache_lock保护
+        self._hash_cache = OrderedDict()
+        self._hash_cache_lock = threading.Lock()
+        # 最近使用的元数据 {(文件路径, 修改时间ns, 大小): 元数据}，按使用顺序排列，由_meta_cache_lock保护
+        self._meta_cache = OrderedDict()
+        self._meta_cache_lock = threading.Lock()
+        # 等待写入数据库的评分 {(缓存目录, 文件路径): (原缓存键, 新缓存键, 评分, os.stat结果)}
+        self._pending_ratings = {}
+        self._pending_ratings_lock = threading.Lock()
+        self._rating_timer = None
+        # 已确认没有图片的子目录树 {目录: (确认时间, {树中各目录: 修改时间ns})}，
+        # 任一目录变化或超过DIR_CACHE_TTL即失效，按使用顺序排列，由_dir_cache_lock保护
+        self._empty_subtrees = OrderedDict()
+        self._dir_cache_lock = threading.Lock()
+        # 后台预取相邻目录列表，信号量限制同时排队的预取任务数
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=2)
+        self._prefetch_slots = threading.Semaphore(4)
+
+        # 正在排队或生成中的任务 {任务类型: {文件路径: (Future, 是否已进入优先通道)}}，
+        # 由_priority_lock保护（需在启动工作线程前创建）
+        self._inflight = {'thumbnail': {}, 'preview': {}, 'metadata': {}}
+        self._priority_lock = threading.Lock()
+        
         # 异步缓存生成相关设置
-        self.cache_queue = queue.Queue()  # 缓存生成队列
-        self.priority_queue = queue.PriorityQueue()  # 优先级队列，用于处理用户请求的图片
+        # 缓存生成任务通道，用户请求的图片优先处理，排队的普通任务不超过TASK_QUEUE_LIMIT个
+        self.task_channel = _TaskChannel(TASK_QUEUE_LIMIT)
         self.cache_workers = []  # 工作线程列表
-        self.max_workers = 2  # 最大工作线程数
+        # Pillow解码、缩放和JPEG编码时会释放GIL，线程数随CPU核心数增加即可并行利用多核
+        # 默认最多8个，避免同时解码过多大图占用内存
+        self.max_workers = self.config.config.get('cache_workers') or max(2, min(os.cpu_count() or 2, 8))
         self.running = True  # 工作线程运行状态
         
         # 启动工作线程
         self._start_workers()
         
-        # 记录需要优先处理的图片
-        self.priority_images = set()
-        
         # 注册退出时的清理函数
-        import atexit
         atexit.register(self._stop_workers)
     
     def get_cache_dir(self, file_path: str) -> str:
         """获取图片文件对应的缓存目录"""
         image_dir = os.path.dirname(file_path)
-        cache_dir = os.path.join(image_dir, '.album_cache')
-        os.makedirs(cache_dir, exist_ok=True)
+        cache_dir = os.path.join(image_dir, CACHE_DIR_NAME)
+        # 每个缓存目录只需创建一次
+        if cache_dir not in self._created_cache_dirs and cache_dir not in self._unwritable_cache_dirs:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning("无法创建缓存目录，该文件夹不生成缓存 %s: %s", cache_dir, e)
+                self._unwritable_cache_dirs.add(cache_dir)
+                return cache_dir
+            self._created_cache_dirs.add(cache_dir)
         return cache_dir
     
-    def get_file_hash(self, file_path: str) -> str:
-        """获取文件哈希值作为缓存键"""
-        stat = os.stat(file_path)
-        content = f"{file_path}_{stat.st_mtime}_{stat.st_size}"
-        return hashlib.md5(content.encode()).hexdigest()
+    def get_file_hash(self, file_path: str, stat: Optional[os.stat_result] = None) -> str:
+        """获取文件哈希值作为缓存键
+        
+        两级查找：先用(路径, 修改时间ns, 大小)查内存和缓存目录数据库中记录的键，
+        都未命中时才抽样读取文件内容计算哈希并记录下来。只改变修改时间的操作（复制、还原备份、
+        git检出）不会让已生成的缩略图和预览图失效
+        
+        Args:
+            file_path: 图片文件路径
+            stat: 调用方已获取的os.stat结果，传入时不再重复stat
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+        return self.get_file_hashes([(file_path, stat)])[0]
+
+    def get_file_hashes(self, items: List[Tuple[str, os.stat_result]]) -> List[str]:
+        """批量获取同一目录中多个文件的缓存键，数据库中的记录用一次IN查询读取
+        
+        Args:
+            items: [(文件路径, os.stat结果)]，所有文件需位于同一目录
+        """
+        hashes = []
+        with self._hash_cache_lock:
+            for path, stat in items:
+                key = (path, stat.st_mtime_ns, stat.st_size)
+                file_hash = self._hash_cache.get(key)
+                if file_hash is not None:
+                    self._hash_cache.move_to_end(key)
+                hashes.append(file_hash)
+        missing = [index for index, file_hash in enumerate(hashes) if file_hash is None]
+        if not missing:
+            return hashes
+        
+        cache_dir = self.get_cache_dir(items[missing[0]][0])
+        stored = self._load_file_keys(cache_dir, [os.path.basename(items[index][0]) for index in missing])
+        new_rows = []
+        legacy = []
+        for index in missing:
+            path, stat = items[index]
+            name = os.path.basename(path)
+            row = stored.get(name)
+            if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+                file_hash = row[2]
+            else:
+                try:
+                    file_hash = compute_content_key(path, stat.st_size)
+                except OSError as e:
+                    # 单个文件读取失败不影响整批，临时键不记录，下次再尝试读取内容
+                    logger.warning("读取文件内容失败 %s: %s", path, e)
+                    hashes[index] = fallback_cache_key(path, stat)
+                    continue
+                new_rows.append((name, stat.st_mtime_ns, stat.st_size, file_hash))
+                legacy.append((path, stat, file_hash))
+            with self._hash_cache_lock:
+                self._hash_cache[(path, stat.st_mtime_ns, stat.st_size)] = file_hash
+                if len(self._hash_cache) > HASH_CACHE_SIZE:
+                    self._hash_cache.popitem(last=False)
+            hashes[index] = file_hash
+        self._save_file_keys(cache_dir, new_rows)
+        self._migrate_legacy_cache(cache_dir, legacy)
+        return hashes
+
+    def _migrate_legacy_cache(self, cache_dir: str, items: List[Tuple[str, os.stat_result, str]]):
+        """把旧版本按路径、修改时间和大小命名的缓存改为内容键，避免升级后重新生成
+        
+        只在文件首次计算内容键时调用，之后数据库中已有记录，不会重复检查
+        
+        Args:
+            items: [(文件路径, os.stat结果, 新的缓存键)]
+        """
+        listing = self._get_cache_listing(cache_dir)
+        if not items or not listing:
+            return
+        
+        renamed = []
+        for path, stat, file_hash in items:
+            old_hash = legacy_cache_key(path, stat.st_mtime, stat.st_size)
+            self._rename_cache_files(cache_dir, listing, old_hash, file_hash)
+            renamed.append((file_hash, old_hash))
+        
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return
+            try:
+                conn.executemany('UPDATE OR IGNORE meta SET hash = ? WHERE hash = ?', renamed)
+            except sqlite3.Error as e:
+                logger.warning("迁移旧元数据缓存失败 %s: %s", cache_dir, e)
+
+    def _rename_cache_files(self, cache_dir: str, listing: set, old_hash: str, new_hash: str):
+        """把缩略图和预览图从旧缓存键改名到新缓存键下，并同步更新缓存目录的文件名集合"""
+        for prefix in ('thumb', 'preview'):
+            old_name = f"{prefix}_{old_hash}.jpg"
+            if old_name not in listing:
+                continue
+            new_name = f"{prefix}_{new_hash}.jpg"
+            try:
+                os.replace(os.path.join(cache_dir, old_name), os.path.join(cache_dir, new_name))
+            except FileNotFoundError:
+                listing.discard(old_name)
+                continue
+            except OSError as e:
+                logger.warning("重命名缓存文件失败 %s: %s", old_name, e)
+                continue
+            listing.discard(old_name)
+            listing.add(new_name)
+
+    def _get_cache_listing(self, cache_dir: str) -> set:
+        """获取缓存目录中的文件名集合
+        
+        每次调用stat一次缓存目录，修改时间与记录的不同时重新扫描；
+        缓存目录被外部删除（如clear_all_caches.py）时重新创建
+        """
+        try:
+            mtime_ns = os.stat(cache_dir).st_mtime_ns
+        except FileNotFoundError:
+            if cache_dir in self._unwritable_cache_dirs:
+                return set()
+            self._created_cache_dirs.discard(cache_dir)
+            self._cache_listing.pop(cache_dir, None)
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                mtime_ns = os.stat(cache_dir).st_mtime_ns
+            except OSError as e:
+                logger.warning("创建缓存目录失败 %s: %s", cache_dir, e)
+                return set()
+            self._created_cache_dirs.add(cache_dir)
+            self._stale_meta_dirs.add(cache_dir)
+        except OSError:
+            return set()
+        
+        cached = self._cache_listing.get(cache_dir)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        
+        # 先stat后扫描，扫描期间发生的变化会让记录的修改时间过期，下次调用时再次扫描
+        try:
+            with os.scandir(cache_dir) as entries:
+                listing = {entry.name for entry in entries}
+        except OSError:
+            return set()
+        self._cache_listing[cache_dir] = (mtime_ns, listing)
+        return listing
+
+    def _cache_file_exists(self, cache_dir: str, file_name: str) -> bool:
+        """检查缓存文件是否已生成（集合查找，不访问文件系统）"""
+        return file_name in self._get_cache_listing(cache_dir)
+
+    def _mark_cache_file(self, cache_dir: str, file_name: str):
+        """记录新生成的缓存文件，并更新记录的目录修改时间，自己写入的文件不会导致重新扫描"""
+        listing = self._get_cache_listing(cache_dir)
+        listing.add(file_name)
+        try:
+            mtime_ns = os.stat(cache_dir).st_mtime_ns
+        except OSError:
+            return
+        if cache_dir in self._cache_listing:
+            self._cache_listing[cache_dir] = (mtime_ns, listing)
+
+    def remove_cached_files(self, file_path: str) -> int:
+        """删除图片对应的缩略图、预览图和元数据缓存
+
+        需要在移动或删除原图之前调用，因为缓存键依赖原图的内容
+
+        Returns:
+            int: 删除的缓存文件数量
+        """
+        cache_dir = self.get_cache_dir(file_path)
+        file_hash = self.get_file_hash(file_path)
+        removed = 0
+        # 同一目录中内容相同的其他文件仍在使用这个缓存键时，保留共用的缩略图和预览图
+        if not self._cache_key_shared(cache_dir, file_path, file_hash):
+            listing = self._get_cache_listing(cache_dir)
+            for prefix in ('thumb', 'preview'):
+                file_name = f"{prefix}_{file_hash}.jpg"
+                listing.discard(file_name)
+                try:
+                    os.remove(os.path.join(cache_dir, file_name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        if self._delete_cached_metadata(cache_dir, file_hash, os.path.basename(file_path)):
+            removed += 1
+        self._delete_file_key(cache_dir, os.path.basename(file_path))
+        return removed
+
+    def _cache_key_shared(self, cache_dir: str, file_path: str, file_hash: str) -> bool:
+        """同一目录中是否还有其他文件使用这个缓存键
+        
+        根据数据库记录的缓存键查找，再stat核对这些文件仍存在且未被修改
+        """
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return False
+            try:
+                rows = conn.execute('SELECT name, mtime_ns, size FROM file_keys WHERE key = ? AND name != ?',
+                                    (file_hash, os.path.basename(file_path))).fetchall()
+            except sqlite3.Error as e:
+                logger.warning("读取缓存键失败 %s: %s", cache_dir, e)
+                return False
+        directory = os.path.dirname(file_path)
+        for name, mtime_ns, size in rows:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if stat.st_mtime_ns == mtime_ns and stat.st_size == size:
+                return True
+        return False
+
+    def _meta_db(self, cache_dir: str) -> Optional[sqlite3.Connection]:
+        """获取缓存目录的元数据数据库连接，调用方需持有_meta_db_lock
+        
+        首次打开时建表，并导入旧版本生成的meta_*.json文件
+        """
+        if cache_dir in self._unwritable_cache_dirs:
+            return None
+        if cache_dir in self._stale_meta_dirs:
+            self._stale_meta_dirs.discard(cache_dir)
+            stale = self._meta_connections.pop(cache_dir, None)
+            if stale is not None:
+                stale.close()
+        conn = self._meta_connections.get(cache_dir)
+        if conn is not None:
+            return conn
+        
+        conn = None
+        try:
+            conn = sqlite3.connect(os.path.join(cache_dir, META_DB_NAME),
+                                   check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            if conn.execute('PRAGMA user_version').fetchone()[0] < META_DB_VERSION:
+                self._upgrade_meta_db(conn)
+        except sqlite3.Error as e:
+            logger.warning("打开元数据数据库失败 %s: %s", cache_dir, e)
+            if conn is not None:
+                conn.close()
+            return None
+        
+        if len(self._meta_connections) >= META_DB_MAX_CONNECTIONS:
+            oldest_dir = next(iter(self._meta_connections))
+            self._meta_connections.pop(oldest_dir).close()
+        self._meta_connections[cache_dir] = conn
+        
+        self._migrate_json_metadata(cache_dir, conn)
+        return conn
+
+    def _upgrade_meta_db(self, conn: sqlite3.Connection):
+        """建表，或把旧版本以缓存键为主键的meta表改为以(缓存键, 文件名)为主键"""
+        conn.execute('BEGIN')
+        try:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'").fetchone()
+            if exists:
+                conn.execute('ALTER TABLE meta RENAME TO meta_old')
+            conn.execute(META_TABLE_SQL)
+            if exists:
+                conn.execute('INSERT OR IGNORE INTO meta SELECT hash, filename, size, mtime, rating, data '
+                             'FROM meta_old')
+                conn.execute('DROP TABLE meta_old')
+            conn.execute('CREATE TABLE IF NOT EXISTS file_keys ('
+                         'name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, key TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS file_keys_key ON file_keys (key)')
+            conn.execute(f'PRAGMA user_version = {META_DB_VERSION}')
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _migrate_json_metadata(self, cache_dir: str, conn: sqlite3.Connection):
+        """把旧版本的meta_{hash}.json导入数据库，导入成功后删除这些JSON文件"""
+        listing = self._get_cache_listing(cache_dir)
+        json_names = [name for name in list(listing)
+                      if name.startswith('meta_') and name.endswith('.json')]
+        if not json_names:
+            return
+        
+        rows = []
+        for name in json_names:
+            try:
+                metadata = load_json_file(os.path.join(cache_dir, name))
+            except (OSError, ValueError) as e:
+                logger.warning("读取旧元数据缓存失败 %s: %s", name, e)
+                continue
+            rows.append(metadata_to_row(name[len('meta_'):-len('.json')], metadata))
+        
+        try:
+            conn.execute('BEGIN')
+            conn.executemany('INSERT OR IGNORE INTO meta VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            conn.execute('ROLLBACK')
+            logger.warning("导入旧元数据缓存失败 %s: %s", cache_dir, e)
+            return
+        
+        for name in json_names:
+            listing.discard(name)
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+        logger.info("已将 %s 个元数据缓存文件导入 %s", len(rows), os.path.join(cache_dir, META_DB_NAME))
+
+    def _close_meta_dbs(self):
+        """关闭所有元数据数据库连接"""
+        with self._meta_db_lock:
+            for conn in self._meta_connections.values():
+                conn.close()
+            self._meta_connections.clear()
+
+    def _load_cached_metadata(self, cache_dir: str, file_hash: str, filename: str) -> Optional[Dict]:
+        """从元数据数据库读取缓存的元数据，不存在时返回None"""
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return None
+            try:
+                row = conn.execute('SELECT filename, size, mtime, rating, data FROM meta '
+                                   'WHERE hash = ? AND filename = ?', (file_hash, filename)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("读取元数据缓存失败 %s: %s", cache_dir, e)
+                return None
+        if row is None:
+            return None
+        return row_to_metadata(row)
+
+    def _load_cached_metadata_many(self, cache_dir: str, file_hashes: List[str]) -> Dict[Tuple[str, str], Dict]:
+        """用一次IN查询读取多个文件的元数据缓存，返回 {(哈希, 文件名): 元数据}，未缓存的文件不在结果中"""
+        if not file_hashes:
+            return {}
+        file_hashes = list(dict.fromkeys(file_hashes))
+        placeholders = ', '.join('?' * len(file_hashes))
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return {}
+            try:
+                rows = conn.execute('SELECT hash, filename, size, mtime, rating, data FROM meta '
+                                    f'WHERE hash IN ({placeholders})', file_hashes).fetchall()
+            except sqlite3.Error as e:
+                logger.warning("读取元数据缓存失败 %s: %s", cache_dir, e)
+                return {}
+        return {(row[0], row[1]): row_to_metadata(row[1:]) for row in rows}
+
+    def _load_file_keys(self, cache_dir: str, names: List[str]) -> Dict[str, Tuple]:
+        """读取数据库中记录的缓存键，返回 {文件名: (修改时间ns, 大小, 缓存键)}"""
+        result = {}
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return result
+            try:
+                for start in range(0, len(names), META_BATCH_SIZE):
+                    chunk = names[start:start + META_BATCH_SIZE]
+                    placeholders = ', '.join('?' * len(chunk))
+                    for name, mtime_ns, size, key in conn.execute(
+                            'SELECT name, mtime_ns, size, key FROM file_keys '
+                            f'WHERE name IN ({placeholders})', chunk):
+                        result[name] = (mtime_ns, size, key)
+            except sqlite3.Error as e:
+                logger.warning("读取缓存键失败 %s: %s", cache_dir, e)
+        return result
+
+    def _save_file_keys(self, cache_dir: str, rows: List[Tuple]):
+        """记录新计算的缓存键，rows为 [(文件名, 修改时间ns, 大小, 缓存键)]"""
+        if not rows:
+            return
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return
+            try:
+                conn.execute('BEGIN')
+                conn.executemany('INSERT OR REPLACE INTO file_keys VALUES (?, ?, ?, ?)', rows)
+                conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                logger.warning("保存缓存键失败 %s: %s", cache_dir, e)
+
+    def _save_cached_metadata(self, cache_dir: str, file_hash: str, metadata: Dict):
+        """保存元数据到数据库"""
+        row = metadata_to_row(file_hash, metadata)
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return
+            conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?, ?)', row)
+
+    def _save_cached_metadata_many(self, cache_dir: str, rows: List[Tuple]):
+        """在一个事务中保存多条元数据，rows由metadata_to_row生成"""
+        if not rows:
+            return
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return
+            try:
+                conn.execute('BEGIN')
+                conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?, ?)', rows)
+                conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                logger.warning("保存元数据缓存失败 %s: %s", cache_dir, e)
+
+    def _delete_cached_metadata(self, cache_dir: str, file_hash: str, filename: str) -> bool:
+        """删除数据库中的元数据，返回是否删除了记录"""
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return False
+            try:
+                return conn.execute('DELETE FROM meta WHERE hash = ? AND filename = ?',
+                                    (file_hash, filename)).rowcount > 0
+            except sqlite3.Error as e:
+                logger.warning("删除元数据缓存失败 %s: %s", cache_dir, e)
+                return False
+
+    def _delete_file_key(self, cache_dir: str, name: str):
+        """删除数据库中记录的文件缓存键"""
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return
+            try:
+                conn.execute('DELETE FROM file_keys WHERE name = ?', (name,))
+            except sqlite3.Error as e:
+                logger.warning("删除缓存键失败 %s: %s", cache_dir, e)
+
+    def _update_cached_rating(self, cache_dir: str, filename: str, old_hash: str, new_hash: str,
+                              rating: int, stat: os.stat_result) -> bool:
+        """更新数据库中的评分，同时把记录移到文件修改后的缓存键下"""
+        with self._meta_db_lock:
+            conn = self._meta_db(cache_dir)
+            if conn is None:
+                return False
+            return conn.execute('UPDATE OR REPLACE meta SET hash = ?, rating = ?, size = ?, mtime = ? '
+                                'WHERE hash = ? AND filename = ?',
+                                (new_hash, rating, stat.st_size, stat.st_mtime, old_hash, filename)).rowcount > 0
+
+    def _schedule_rating_update(self, cache_dir: str, file_path: str, old_hash: str, new_hash: str,
+                                rating: int, stat: os.stat_result):
+        """延迟RATING_WRITE_DELAY秒把评分写入数据库，期间同一文件的多次修改合并为一次写入
+        
+        等待期间内存中的元数据已是新评分，读取不受影响
+        """
+        with self._pending_ratings_lock:
+            pending = self._pending_ratings.get((cache_dir, file_path))
+            if pending is not None:
+                # 数据库中的记录仍在第一次修改前的缓存键下
+                old_hash = pending[0]
+            self._pending_ratings[(cache_dir, file_path)] = (old_hash, new_hash, rating, stat)
+            if self._rating_timer is not None:
+                self._rating_timer.cancel()
+            self._rating_timer = threading.Timer(RATING_WRITE_DELAY, self._flush_rating_updates)
+            self._rating_timer.daemon = True
+            self._rating_timer.start()
     
+    def _flush_rating_updates(self):
+        """把等待中的评分写入数据库"""
+        with self._pending_ratings_lock:
+            pending, self._pending_ratings = self._pending_ratings, {}
+            timer, self._rating_timer = self._rating_timer, None
+        if timer is not None:
+            timer.cancel()
+        for (cache_dir, file_path), (old_hash, new_hash, rating, stat) in pending.items():
+            try:
+                if self._update_cached_rating(cache_dir, os.path.basename(file_path),
+                                              old_hash, new_hash, rating, stat):
+                    logger.debug("成功更新元数据缓存: %s", file_path)
+            except Exception as e:
+                logger.warning("更新元数据缓存失败 %s: %s", file_path, e)
+
+    def get_cached_metadata(self, file_path: str) -> Optional[Dict]:
+        """读取图片已缓存的元数据，没有缓存时返回None（不会提取元数据）"""
+        stat = os.stat(file_path)
+        recent = self._recall_metadata(file_path, stat)
+        if recent is not None:
+            return recent
+        return self._load_cached_metadata(self.get_cache_dir(file_path), self.get_file_hash(file_path, stat),
+                                          os.path.basename(file_path))
+
     def _start_workers(self):
-        """启动工作线程"""
+        """启动工作线程
+        
+        除了处理所有任务的工作线程，另有一个只处理优先通道的线程，
+        其他线程都在生成批量缓存时，用户点击的预览图也不必等它们完成当前任务
+        """
         for _ in range(self.max_workers):
             worker = threading.Thread(target=self._worker_thread, daemon=True)
             worker.start()
             self.cache_workers.append(worker)
-        print(f"已启动 {self.max_workers} 个缓存生成工作线程")
+        priority_worker = threading.Thread(target=self._worker_thread, args=(True,), daemon=True)
+        priority_worker.start()
+        self.cache_workers.append(priority_worker)
+        logger.info("已启动 %s 个缓存生成工作线程和 1 个优先任务线程", self.max_workers)
     
     def _stop_workers(self):
         """停止工作线程"""
         self.running = False
-        # 清空队列并添加结束信号
-        for _ in range(self.max_workers):
-            self.cache_queue.put(None)
-            self.priority_queue.put((0, None))
+        self._flush_rating_updates()
+        # 添加结束信号，唤醒所有等待中的工作线程
+        self.task_channel.close(len(self.cache_workers))
+        self._prefetch_pool.shutdown(wait=False)
         # 等待所有线程结束
         for worker in self.cache_workers:
             worker.join(timeout=2.0)
-        print(f"已停止所有缓存生成工作线程")
+        self._close_meta_dbs()
+        logger.info("已停止所有缓存生成工作线程")
     
-    def _worker_thread(self):
-        """工作线程主函数，处理异步生成缩略图和预览图的任务"""
+    def submit(self, task_type: str, file_path: str, high_priority: bool = False) -> Future:
+        """提交缓存生成任务，同一文件的同类任务在完成前只会排队一次
+        
+        Args:
+            task_type: 任务类型（thumbnail/preview/metadata）
+            file_path: 图片文件路径
+            high_priority: 是否放入优先通道
+        
+        Returns:
+            Future: 任务对应的Future，重复提交时返回已有的Future
+        """
+        with self._priority_lock:
+            inflight = self._inflight[task_type]
+            entry = inflight.get(file_path)
+            if entry is not None:
+                future, queued_high = entry
+                # 已在普通通道排队的任务被用户请求时，再放一份到优先通道，
+                # 两份任务共用同一个Future，先取到的线程执行，另一份直接跳过
+                if high_priority and not queued_high and not future.running():
+                    inflight[file_path] = (future, True)
+                    self.task_channel.put({'type': task_type, 'file_path': file_path,
+                                           'future': future, 'priority': True},
+                                          high_priority=True)
+                return future
+            
+            future = Future()
+            inflight[file_path] = (future, high_priority)
+            evicted = self.task_channel.put({'type': task_type, 'file_path': file_path,
+                                             'future': future, 'priority': high_priority},
+                                            high_priority=high_priority)
+            dropped = self._evicted_futures(evicted)
+        
+        future.add_done_callback(lambda f: self._forget_inflight(task_type, file_path, f))
+        for dropped_future in dropped:
+            dropped_future.cancel()
+        return future
+    
+    def submit_many(self, task_type: str, file_paths: List[str]) -> List[Future]:
+        """批量提交普通优先级任务，只加一次锁并一次性放入任务通道
+        
+        Returns:
+            List[Future]: 与file_paths一一对应的Future，已在排队的文件返回已有的Future
+        """
+        futures = []
+        new_entries = []
+        tasks = []
+        with self._priority_lock:
+            inflight = self._inflight[task_type]
+            for file_path in file_paths:
+                entry = inflight.get(file_path)
+                if entry is not None:
+                    futures.append(entry[0])
+                    continue
+                future = Future()
+                inflight[file_path] = (future, False)
+                futures.append(future)
+                new_entries.append((file_path, future))
+                tasks.append({'type': task_type, 'file_path': file_path,
+                              'future': future, 'priority': False})
+            dropped = self._evicted_futures(self.task_channel.put_many(tasks))
+        
+        for file_path, future in new_entries:
+            future.add_done_callback(functools.partial(self._forget_inflight, task_type, file_path))
+        for dropped_future in dropped:
+            dropped_future.cancel()
+        return futures
+    
+    def _evicted_futures(self, evicted: List[Dict]) -> List[Future]:
+        """找出被任务通道丢弃后需要取消的Future，调用方需持有_priority_lock
+        
+        已提升到优先通道的任务还有一份在排队，不取消。取消操作会回调_forget_inflight，
+        必须在释放锁之后进行
+        """
+        futures = []
+        for task in evicted:
+            entry = self._inflight[task['type']].get(task['file_path'])
+            if entry is not None and entry[0] is task['future'] and not entry[1]:
+                futures.append(task['future'])
+        return futures
+    
+    def _forget_inflight(self, task_type: str, file_path: str, future: Future):
+        """任务完成后从在途表中移除"""
+        with self._priority_lock:
+            entry = self._inflight[task_type].get(file_path)
+            if entry is not None and entry[0] is future:
+                del self._inflight[task_type][file_path]
+    
+    def _claim_task(self, future: Future) -> bool:
+        """认领任务，同一Future的重复任务只有第一个被取出的会执行"""
+        with self._priority_lock:
+            if future.done() or future.running():
+                return False
+            return future.set_running_or_notify_cancel()
+    
+    def _run_task(self, task_type: str, file_path: str, priority: bool = False):
+        """根据任务类型执行缓存生成"""
+        if task_type == 'thumbnail':
+            logger.debug("异步生成缩略图: %s", file_path)
+            return self.generate_thumbnail(file_path)
+        if task_type == 'preview':
+            if priority:
+                logger.debug("优先级处理预览图: %s", file_path)
+            else:
+                logger.debug("异步生成预览图: %s", file_path)
+            return self.generate_preview(file_path)
+        if task_type == 'metadata':
+            logger.debug("异步提取元数据: %s", file_path)
+            return self.extract_metadata(file_path)
+        raise ValueError(f"未知的任务类型: {task_type}")
+    
+    def _worker_thread(self, high_only: bool = False):
+        """工作线程主函数，处理异步生成缩略图和预览图的任务
+        
+        Args:
+            high_only: 只处理优先通道中的任务
+        """
         while self.running:
+            # 阻塞等待任务，优先级任务（用户直接点击查看的图片）总是先取出
+            task = self.task_channel.get(high_only)
+            if task is None:  # 结束信号
+                break
+            
+            if task['type'] == 'metadata' and not task.get('priority'):
+                # 普通元数据任务与队首连续的同类任务合并，评分只需一条exiftool命令读取
+                batch = [task] + self.task_channel.take_low_run('metadata', META_BATCH_SIZE - 1)
+                self._run_metadata_batch(batch)
+                continue
+            
+            future = task['future']
+            if not self._claim_task(future):
+                # 同一任务已由其他线程处理（优先通道与普通通道各有一份）
+                continue
+            
             try:
-                # 先检查优先级队列（优先处理用户直接点击查看的图片）
-                try:
-                    # 使用较短的超时，以便定期检查running状态
-                    priority, task = self.priority_queue.get(timeout=0.5)
-                    if task is None:  # 结束信号
-                        self.priority_queue.task_done()
-                        break
-                    # 处理优先级任务
-                    if task['type'] == 'preview':
-                        file_path = task['file_path']
-                        print(f"优先级处理预览图: {file_path}")
-                        self._process_preview_task(file_path)
-                    self.priority_queue.task_done()
-                    continue  # 处理完优先级任务后，继续下一次循环，优先处理其他优先级任务
-                except queue.Empty:
-                    pass  # 优先级队列为空，检查普通队列
-                
-                # 检查普通队列（处理目录浏览时的批量生成任务）
-                try:
-                    task = self.cache_queue.get(timeout=0.5)
-                    if task is None:  # 结束信号
-                        self.cache_queue.task_done()
-                        break
-                    # 处理普通任务
-                    file_path = task['file_path']
-                    task_type = task['type']
-                    
-                    # 检查这个任务是否已被添加到优先级队列
-                    with threading.Lock():
-                        if task_type == 'preview' and file_path in self.priority_images:
-                            # 如果已经在优先级队列中，跳过此任务
-                            self.cache_queue.task_done()
-                            continue
-                    
-                    # 根据任务类型处理
-                    if task_type == 'thumbnail':
-                        print(f"异步生成缩略图: {file_path}")
-                        self.generate_thumbnail(file_path)
-                    elif task_type == 'preview':
-                        print(f"异步生成预览图: {file_path}")
-                        self.generate_preview(file_path)
-                    elif task_type == 'metadata':
-                        print(f"异步提取元数据: {file_path}")
-                        self.extract_metadata(file_path)
-                    
-                    self.cache_queue.task_done()
-                except queue.Empty:
-                    pass  # 两个队列都为空，继续循环
+                result = self._run_task(task['type'], task['file_path'], task.get('priority'))
             except Exception as e:
-                print(f"工作线程异常: {e}")
+                logger.warning("工作线程异常 %s: %s", task['file_path'], e)
+                future.set_exception(e)
+            else:
+                future.set_result(result)
     
-    def _process_preview_task(self, file_path):
-        """处理预览图任务"""
+    def _run_metadata_batch(self, tasks: List[Dict]):
+        """用extract_metadata_batch合并执行多个元数据任务，每个任务的Future得到对应文件的元数据"""
+        tasks = [task for task in tasks if self._claim_task(task['future'])]
+        if not tasks:
+            return
+        logger.debug("异步批量提取元数据: %s 个文件", len(tasks))
         try:
-            # 先检查是否已经生成了预览图
-            cache_dir = self.get_cache_dir(file_path)
-            file_hash = self.get_file_hash(file_path)
-            preview_path = os.path.join(cache_dir, f"preview_{file_hash}.jpg")
-            
-            if not os.path.exists(preview_path):
-                print(f"优先级处理预览图: {file_path}")
-                self.generate_preview(file_path)
-            else:
-                print(f"预览图已存在，无需重新生成: {file_path}")
-            
-            # 从优先级图片集合中移除
-            with threading.Lock():
-                self.priority_images.discard(file_path)
+            results = self.extract_metadata_batch([task['file_path'] for task in tasks])
         except Exception as e:
-            print(f"处理预览图任务失败 {file_path}: {e}")
+            logger.warning("批量提取元数据失败: %s", e)
+            for task in tasks:
+                task['future'].set_exception(e)
+            return
+        for task in tasks:
+            task['future'].set_result(results.get(task['file_path']))
     
     def prioritize_preview(self, file_path):
         """优先处理指定文件的预览图生成
@@ -213,53 +1559,32 @@ class ImageProcessor:
         try:
             # 检查文件是否存在
             if not os.path.exists(file_path):
-                print(f"错误: 文件不存在 - {file_path}")
+                logger.warning("文件不存在 - %s", file_path)
                 return False
             
             # 检查预览图是否已存在
             cache_dir = self.get_cache_dir(file_path)
             file_hash = self.get_file_hash(file_path)
-            preview_path = os.path.join(cache_dir, f"preview_{file_hash}.jpg")
             
-            if os.path.exists(preview_path):
-                print(f"预览图已存在，无需优先处理: {file_path}")
+            if self._cache_file_exists(cache_dir, f"preview_{file_hash}.jpg"):
+                logger.debug("预览图已存在，无需优先处理: %s", file_path)
                 return True
             
-            # 检查是否已经在优先级队列中
-            with threading.Lock():
-                if file_path in self.priority_images:
-                    print(f"预览图已在优先级队列中: {file_path}")
-                    return True
-                
-                # 添加到优先级集合和队列
-                self.priority_images.add(file_path)
-                # 使用高优先级（较小的数字表示较高优先级）
-                self.priority_queue.put((1, {'type': 'preview', 'file_path': file_path}))
-                
-            print(f"已将{file_path}添加到预览图优先级队列")
+            # 已在排队的任务会被提升到优先通道，不会重复生成
+            self.submit('preview', file_path, high_priority=True)
+            logger.debug("已将%s添加到预览图优先级队列", file_path)
             return True
         except Exception as e:
-            print(f"添加预览图优先级任务失败: {e}")
-            # 出现异常时，从优先级集合中移除（如果已添加）
-            with threading.Lock():
-                self.priority_images.discard(file_path)
+            logger.warning("添加预览图优先级任务失败: %s", e)
             return False
     
     def is_supported_format(self, file_path: str) -> bool:
         """检查是否为支持的图片格式"""
-        ext = os.path.splitext(file_path)[1].lower()
-        return ext in self.config.config['supported_formats']
+        return os.path.splitext(file_path)[1].lower() in self._ext_roles
     
     def is_raw_format(self, file_path: str) -> bool:
         """检查是否为RAW格式"""
-        ext = os.path.splitext(file_path)[1].lower()
-        # 扩展RAW格式列表以支持更多类型，包括Canon的CR3格式
-        raw_formats = ['.raw', '.cr2', '.cr3', '.nef', '.arw', '.dng', '.orf', '.rw2',
-                      '.crw', '.mrw', '.pef', '.raf', '.sr2', '.srf', '.x3f',
-                      '.tif', '.tiff', '.dcr', '.kdc', '.mos', '.erf']
-        result = ext in raw_formats
-        print(f"检查文件格式: {file_path}, 扩展名: {ext}, 是否RAW: {result}")
-        return result
+        return os.path.splitext(file_path)[1].lower() in RAW_EXTS
     
     def load_image(self, file_path: str) -> Optional[Image.Image]:
         """加载图片，支持RAW格式"""
@@ -272,332 +1597,460 @@ class ImageProcessor:
             else:
                 return Image.open(file_path)
         except Exception as e:
-            print(f"加载图片失败 {file_path}: {e}")
+            logger.warning("加载图片失败 %s: %s", file_path, e)
             return None
 
-    def _process_raw_file_for_preview(self, file_path: str, file_hash: str, cache_dir: str) -> Optional[Image.Image]:
-        """统一处理RAW文件预览图：提取嵌入JPEG或占位图，并正确修正方向"""
+    def _process_raw_file_for_preview(self, file_path: str) -> Optional[Image.Image]:
+        """统一处理RAW文件预览图：提取嵌入JPEG或占位图，并正确修正方向
+        
+        提取的JPEG数据和占位图都只在内存中处理，不再写入临时文件
+        """
         try:
             file_extension = os.path.splitext(file_path)[1].lower()
-            print(f"处理RAW文件: {file_path} 扩展名: {file_extension}")
-            temp_image_path = None
+            logger.debug("处理RAW文件: %s 扩展名: %s", file_path, file_extension)
+            image = None
             try:
                 if file_extension == '.cr3':
-                    with open(file_path, 'rb') as f:
-                        file_data = f.read()
-                        jpeg_starts = []
-                        pos = 0
-                        while True:
-                            pos = file_data.find(b'\xff\xd8', pos)
-                            if pos == -1:
-                                break
-                            jpeg_starts.append(pos)
-                            pos += 1
-                        best_jpeg_data = None
-                        best_jpeg_size = 0
-                        for jpeg_start in jpeg_starts:
-                            jpeg_end = file_data.find(b'\xff\xd9', jpeg_start)
-                            if jpeg_end != -1:
-                                cand = file_data[jpeg_start:jpeg_end+2]
-                                if len(cand) > best_jpeg_size:
-                                    best_jpeg_size = len(cand)
-                                    best_jpeg_data = cand
+                    # 使用内存映射扫描，不把整个RAW文件读入Python内存
+                    with open(file_path, 'rb') as f, \
+                            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as file_data:
+                        # 标记顺序访问，内核会加大预读并及早回收扫描过的页面（仅Unix提供madvise）
+                        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                            file_data.madvise(mmap.MADV_SEQUENTIAL)
+                        jpeg_span = find_largest_embedded_jpeg(file_data)
+                        best_jpeg_data = file_data[jpeg_span[0]:jpeg_span[1]] if jpeg_span else None
                         if best_jpeg_data:
-                            temp_image_path = os.path.join(cache_dir, f"temp_thumb_preview_{file_hash}.jpg")
-                            with open(temp_image_path, 'wb') as jf:
-                                jf.write(best_jpeg_data)
-                            print(f"  成功提取CR3嵌入JPEG预览图")
+                            image = Image.open(io.BytesIO(best_jpeg_data))
+                            image.load()
+                            logger.debug("成功提取CR3嵌入JPEG预览图")
             except Exception as e:
-                print(f"  提取缩略图时出错: {e}")
-            if not temp_image_path:
-                placeholder_size = 300
-                placeholder = Image.new('RGB', (placeholder_size, placeholder_size), color='gray')
-                draw = ImageDraw.Draw(placeholder)
-                text = "RAW\n文件"
-                font = ImageFont.load_default()
-                tb = draw.textbbox((0, 0), text, font=font)
-                position = ((placeholder_size - (tb[2]-tb[0]))//2, (placeholder_size - (tb[3]-tb[1]))//2)
-                draw.text(position, text, fill='white', font=font)
-                temp_image_path = os.path.join(cache_dir, f"temp_thumb_preview_{file_hash}.jpg")
-                placeholder.save(temp_image_path, 'JPEG', quality=85)
-            if temp_image_path and os.path.exists(temp_image_path):
-                image = Image.open(temp_image_path)
-                image = self.fix_image_orientation(image)
-                try:
-                    os.remove(temp_image_path)
-                except:
-                    pass
-                return image
-            else:
-                print("  未能创建临时图像文件")
-                return None
+                logger.warning("提取缩略图时出错: %s", e)
+                image = None
+            if image is None:
+                # 占位图没有EXIF方向信息，直接返回
+                return raw_placeholder().copy()
+            return self.fix_image_orientation(image)
         except Exception as e:
-            print(f"处理RAW文件时发生错误: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("处理RAW文件时发生错误 %s: %s", file_path, e)
             return None
 
-    def _resize_and_save_image(self, image: Image.Image, output_path: str, max_width: int, max_height: int, quality: int) -> bool:
-        """统一处理图片的缩放和保存"""
-        try:
-            # 计算缩放比例
-            img_width, img_height = image.size
-            aspect_ratio = img_width / img_height
-            print(f"  原始尺寸: {img_width}x{img_height}, 宽高比: {aspect_ratio:.2f}")
-            
-            # 根据宽高比例调整最终尺寸
-            if max_width > 0 and max_height == 0:
-                # 只限制宽度，高度按比例缩放
+    def _calculate_target_size(self, img_width: int, img_height: int, max_width: int, max_height: int) -> Tuple[int, int]:
+        """根据配置的最大宽高计算保持原比例的目标尺寸"""
+        aspect_ratio = img_width / img_height
+        
+        # 根据宽高比例调整最终尺寸
+        if max_width > 0 and max_height == 0:
+            # 只限制宽度，高度按比例缩放
+            new_width = min(max_width, img_width)
+            new_height = int(new_width / aspect_ratio)
+        elif max_height > 0 and max_width == 0:
+            # 只限制高度，宽度按比例缩放
+            new_height = min(max_height, img_height)
+            new_width = int(new_height * aspect_ratio)
+        else:
+            # 限制宽高，按原比例缩放
+            if aspect_ratio > 1:  # 横屏图片
                 new_width = min(max_width, img_width)
                 new_height = int(new_width / aspect_ratio)
-            elif max_height > 0 and max_width == 0:
-                # 只限制高度，宽度按比例缩放
+            else:  # 竖屏图片
                 new_height = min(max_height, img_height)
                 new_width = int(new_height * aspect_ratio)
-            else:
-                # 限制宽高，按原比例缩放
-                if aspect_ratio > 1:  # 横屏图片
-                    new_width = min(max_width, img_width)
-                    new_height = int(new_width / aspect_ratio)
-                else:  # 竖屏图片
-                    new_height = min(max_height, img_height)
-                    new_width = int(new_height * aspect_ratio)
-            print(f"  调整后尺寸: {new_width}x{new_height}")
+        return new_width, new_height
+
+    def _apply_jpeg_draft(self, image: Image.Image, max_width: int, max_height: int) -> Image.Image:
+        """JPEG图片在解码前设置draft，让libjpeg按1/2、1/4或1/8比例直接缩小解码
+        
+        draft尺寸保留目标尺寸的2倍，之后仍用LANCZOS缩放到最终尺寸以保证质量
+        """
+        if image.format != 'JPEG':
+            return image
+        
+        # draft作用于旋转前的尺寸，EXIF方向为5-8时宽高互换
+        img_width, img_height = image.size
+        rotated = self.get_image_orientation(image) in (5, 6, 7, 8)
+        if rotated:
+            img_width, img_height = img_height, img_width
+        new_width, new_height = self._calculate_target_size(img_width, img_height, max_width, max_height)
+        draft_size = (new_width * 2, new_height * 2)
+        if rotated:
+            draft_size = (draft_size[1], draft_size[0])
+        
+        image.draft(image.mode, draft_size)
+        return image
+
+    def _jpeg_save_options(self, progressive: bool = False) -> Dict:
+        """JPEG编码参数
+        
+        缩略图只做基线编码；预览图较大，使用渐进式编码便于浏览器边下载边显示。
+        optimize会多做一遍Huffman表计算，编码耗时约翻倍而体积只小几个百分点，默认关闭
+        """
+        return {
+            'subsampling': 2,
+            'progressive': progressive,
+            'optimize': bool(self.config.config.get('optimize_jpeg', False)),
+        }
+
+    def _resize_vips(self, src_path: str, output_path: str, max_width: int, max_height: int, quality: int,
+                     progressive: bool = False) -> bool:
+        """使用libvips缩放并保存图片（仅用于非RAW图片）
+        
+        libvips在解码时直接缩小并按EXIF方向自动旋转，缩放结果与Pillow路径的尺寸一致
+        
+        Returns:
+            bool: 是否成功，失败时调用方应回退到Pillow
+        """
+        if not VIPS_AVAILABLE:
+            return False
+        try:
+            # 只读取文件头获取尺寸，EXIF方向为5-8时宽高互换
+            header = pyvips.Image.new_from_file(src_path, access='sequential')
+            img_width, img_height = header.width, header.height
+            if header.get_typeof('orientation') and header.get('orientation') in (5, 6, 7, 8):
+                img_width, img_height = img_height, img_width
+            new_width, new_height = self._calculate_target_size(img_width, img_height, max_width, max_height)
+            
+            image = pyvips.Image.thumbnail(src_path, max(new_width, 1),
+                                           height=max(new_height, 1), size='down')
+            
+            # 处理透明通道，与Pillow路径一样使用白色背景
+            if image.hasalpha():
+                image = image.flatten(background=[255, 255, 255])
+            if image.interpretation != 'srgb':
+                image = image.colourspace('srgb')
+            
+            options = self._jpeg_save_options(progressive)
+            save_atomically(output_path, lambda path: image.jpegsave(
+                path, Q=quality, optimize_coding=options['optimize'],
+                interlace=options['progressive'], subsample_mode='on', strip=True))
+            return True
+        except (pyvips.Error, OSError, ValueError) as e:
+            # 除libvips自身的错误外，保存临时文件或替换目标文件时的OSError、参数错误也回退到Pillow
+            logger.warning("libvips处理失败，回退到Pillow %s: %s", src_path, e)
+            return False
+
+    def _flatten_to_rgb(self, image: Image.Image) -> Image.Image:
+        """转换为RGB模式，只有透明通道确实存在半透明像素时才合成白色背景"""
+        if image.mode == 'P':
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if image.mode in ('RGBA', 'LA'):
+            alpha = image.getchannel('A')
+            if alpha.getextrema()[0] < 255:
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image.convert('RGB'), mask=alpha)
+                return background
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
+    def _resize_and_save_image(self, image: Image.Image, output_path: str, max_width: int, max_height: int, quality: int,
+                               progressive: bool = False, orientation: int = 1) -> bool:
+        """统一处理图片的缩放和保存
+        
+        orientation为尚未应用的EXIF方向：先按旋转后的目标尺寸缩放，再对缩小后的图片做转置，
+        避免在原尺寸图片上旋转产生一整份中间图
+        """
+        try:
+            # 计算缩放比例，方向为5-8时按旋转后的宽高计算
+            img_width, img_height = image.size
+            swapped = orientation in (5, 6, 7, 8)
+            if swapped:
+                img_width, img_height = img_height, img_width
+            logger.debug("原始尺寸: %dx%d, 宽高比: %.2f", img_width, img_height, img_width / img_height)
+            new_width, new_height = self._calculate_target_size(img_width, img_height, max_width, max_height)
+            logger.debug("调整后尺寸: %dx%d", new_width, new_height)
             
             # 使用resize而不是thumbnail，以确保精确控制尺寸
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            resize_size = (new_height, new_width) if swapped else (new_width, new_height)
+            image = image.resize(resize_size, Image.Resampling.LANCZOS)
+            
+            # 在缩小后的图片上修正方向
+            method = ORIENTATION_TRANSPOSE.get(orientation)
+            if method is not None:
+                image = image.transpose(method)
             
             # 处理透明通道，转换为RGB模式
-            if image.mode in ('RGBA', 'LA', 'P'):
-                # 创建白色背景
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'P':
-                    image = image.convert('RGBA')
-                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = background
-            elif image.mode != 'RGB':
-                image = image.convert('RGB')
+            image = self._flatten_to_rgb(image)
             
             # 保存图片
-            image.save(output_path, 'JPEG', quality=quality, optimize=True, progressive=True)
-            print(f"  成功保存到: {output_path}")
+            save_options = self._jpeg_save_options(progressive)
+            save_atomically(output_path, lambda path: image.save(path, 'JPEG', quality=quality, **save_options))
+            logger.debug("成功保存到: %s", output_path)
             return True
         except Exception as e:
-            print(f"缩放和保存图片失败 {output_path}: {e}")
+            logger.warning("缩放和保存图片失败 %s: %s", output_path, e)
             return False
 
     def generate_thumbnail(self, file_path: str) -> Optional[str]:
         """生成缩略图（保持原比例，根据配置和图片方向智能计算尺寸）"""
         cache_dir = self.get_cache_dir(file_path)
+        if cache_dir in self._unwritable_cache_dirs:
+            return None
         file_hash = self.get_file_hash(file_path)
-        thumbnail_path = os.path.join(cache_dir, f"thumb_{file_hash}.jpg")
+        thumbnail_name = f"thumb_{file_hash}.jpg"
+        thumbnail_path = os.path.join(cache_dir, thumbnail_name)
         
-        if os.path.exists(thumbnail_path):
+        if self._cache_file_exists(cache_dir, thumbnail_name):
             return thumbnail_path
         
         try:
             # 对于RAW文件的特殊处理
             if self.is_raw_format(file_path):
                 # 使用统一的RAW文件处理方法
-                image = self._process_raw_file_for_preview(file_path, file_hash, cache_dir)
+                image = self._process_raw_file_for_preview(file_path)
                 if image:
                     # 获取配置的缩略图尺寸，默认为[300, 0]
                     thumbnail_size = self.config.config.get('thumbnail_size', [300, 0])
                     max_width, max_height = thumbnail_size
                     thumbnail_quality = self.config.config.get('thumbnail_quality', 70)
                     
-                    # 检查提取的图片尺寸，如果太小则进行适当放大
-                    img_width, img_height = image.size
-                    if img_width < 200 or img_height < 200:
-                        print(f"  检测到小尺寸图片({img_width}x{img_height})，将进行适当放大")
-                        # 强制放大到合理尺寸，但不超过配置的最大值
-                        scale_factor = 2  # 放大倍数
-                        if max_width > 0:
-                            new_width = min(max_width, int(img_width * scale_factor))
-                        else:
-                            new_width = int(img_width * scale_factor)
-                        if max_height > 0:
-                            new_height = min(max_height, int(img_height * scale_factor))
-                        else:
-                            new_height = int(img_height * scale_factor)
-                        
-                        # 使用LANCZOS滤镜进行高质量放大
-                        # image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                        target_size = (new_width, new_height) if width and height else (width or new_width, height or new_height)
-                        image = ImageOps.fit(image, target_size, Image.Resampling.LANCZOS, centering=(0.5, 0.5))
-
-                        print(f"  放大后尺寸: {new_width}x{new_height}")
-                    
+                    # 嵌入预览图小于目标尺寸时_resize_and_save_image按原尺寸保存，不放大
                     if self._resize_and_save_image(image, thumbnail_path, max_width, max_height, thumbnail_quality):
+                        self._mark_cache_file(cache_dir, thumbnail_name)
                         return thumbnail_path
                 # 如果无法提取预览图，返回None
                 return None
             
             # 非RAW文件的标准处理
+            thumbnail_size = self.config.config.get('thumbnail_size', [300, 0])
+            thumbnail_quality = self.config.config.get('thumbnail_quality', 70)
+            if self._resize_vips(file_path, thumbnail_path, thumbnail_size[0], thumbnail_size[1], thumbnail_quality):
+                self._mark_cache_file(cache_dir, thumbnail_name)
+                return thumbnail_path
+            
             image = self.load_image(file_path)
             if not image:
                 return None
             
-            # 处理EXIF方向信息
-            image = self.fix_image_orientation(image)
-            
             # 获取配置的缩略图尺寸
-            thumbnail_size = self.config.config.get('thumbnail_size', [300, 0])
             width, height = thumbnail_size
             
-            # 计算缩放比例
-            img_width, img_height = image.size
-            aspect_ratio = img_width / img_height
-            
-            # 根据宽高比例调整最终尺寸
-            if width > 0 and height == 0:
-                # 只限制宽度，高度按比例缩放
-                new_width = min(width, img_width)
-                new_height = int(new_width / aspect_ratio)
-            elif height > 0 and width == 0:
-                # 只限制高度，宽度按比例缩放
-                new_height = min(height, img_height)
-                new_width = int(new_height * aspect_ratio)
-            else:
-                # 限制宽高，按原比例缩放
-                if aspect_ratio > 1:  # 横屏图片
-                    new_width = min(width, img_width)
-                    new_height = int(new_width / aspect_ratio)
-                else:  # 竖屏图片
-                    new_height = min(height, img_height)
-                    new_width = int(new_height * aspect_ratio)
-            
-            # 使用resize而不是thumbnail，以确保精确控制尺寸
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # 处理透明通道，转换为RGB模式
-            if image.mode in ('RGBA', 'LA', 'P'):
-                # 创建白色背景
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'P':
-                    image = image.convert('RGBA')
-                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = background
-            elif image.mode != 'RGB':
-                image = image.convert('RGB')
+            # JPEG直接按缩小比例解码，避免解码全部像素后再丢弃
+            image = self._apply_jpeg_draft(image, width, height)
             
-            thumbnail_quality = self.config.config.get('thumbnail_quality', 70)
-            image.save(thumbnail_path, 'JPEG', quality=thumbnail_quality, optimize=True, progressive=True)
-            return thumbnail_path
+            # 缩放后再按EXIF方向转置
+            orientation = self.get_image_orientation(image)
+            if self._resize_and_save_image(image, thumbnail_path, width, height, thumbnail_quality,
+                                           orientation=orientation):
+                self._mark_cache_file(cache_dir, thumbnail_name)
+                return thumbnail_path
+            return None
             
         except Exception as e:
-            print(f"生成缩略图失败 {file_path}: {e}")
+            logger.warning("生成缩略图失败 %s: %s", file_path, e)
             return None
     
     def generate_preview(self, file_path: str) -> Optional[str]:
         """生成预览图：按EXIF修正方向并缩放"""
         cache_dir = self.get_cache_dir(file_path)
+        if cache_dir in self._unwritable_cache_dirs:
+            return None
         file_hash = self.get_file_hash(file_path)
-        preview_path = os.path.join(cache_dir, f"preview_{file_hash}.jpg")
-        if os.path.exists(preview_path):
+        preview_name = f"preview_{file_hash}.jpg"
+        preview_path = os.path.join(cache_dir, preview_name)
+        if self._cache_file_exists(cache_dir, preview_name):
             return preview_path
         try:
             if self.is_raw_format(file_path):
-                image = self._process_raw_file_for_preview(file_path, file_hash, cache_dir)
+                image = self._process_raw_file_for_preview(file_path)
                 if not image:
                     return None
                 max_size = self.config.config.get('preview_max_size', 1600)
                 preview_quality = self.config.config.get('preview_quality', 75)
-                if self._resize_and_save_image(image, preview_path, max_size, 0, preview_quality):
+                if self._resize_and_save_image(image, preview_path, max_size, 0, preview_quality, progressive=True):
+                    self._mark_cache_file(cache_dir, preview_name)
                     return preview_path
                 return None
+            max_size = self.config.config.get('preview_max_size', 1600)
+            preview_quality = self.config.config.get('preview_quality', 75)
+            if self._resize_vips(file_path, preview_path, max_size, 0, preview_quality, progressive=True):
+                self._mark_cache_file(cache_dir, preview_name)
+                return preview_path
             image = self.load_image(file_path)
             if not image:
                 return None
-            image = self.fix_image_orientation(image)
-            max_size = self.config.config.get('preview_max_size', 1600)
-            preview_quality = self.config.config.get('preview_quality', 75)
-            if self._resize_and_save_image(image, preview_path, max_size, 0, preview_quality):
+            image = self._apply_jpeg_draft(image, max_size, 0)
+            orientation = self.get_image_orientation(image)
+            if self._resize_and_save_image(image, preview_path, max_size, 0, preview_quality,
+                                           progressive=True, orientation=orientation):
+                self._mark_cache_file(cache_dir, preview_name)
                 return preview_path
             return None
         except Exception as e:
-            print(f"生成预览图失败 {file_path}: {e}")
+            logger.warning("生成预览图失败 %s: %s", file_path, e)
             return None
     
-    def extract_metadata(self, file_path: str) -> Dict:
-        """提取图片元数据"""
+    def _recall_metadata(self, file_path: str, stat: os.stat_result) -> Optional[Dict]:
+        """从内存中取出文件最近使用的元数据，文件修改后不再命中"""
+        key = (file_path, stat.st_mtime_ns, stat.st_size)
+        with self._meta_cache_lock:
+            metadata = self._meta_cache.get(key)
+            if metadata is not None:
+                self._meta_cache.move_to_end(key)
+        return metadata
+    
+    def _remember_metadata(self, file_path: str, stat: os.stat_result, metadata: Dict):
+        """把元数据放入内存，超过META_CACHE_SIZE时丢弃最久未使用的"""
+        key = (file_path, stat.st_mtime_ns, stat.st_size)
+        with self._meta_cache_lock:
+            self._meta_cache[key] = metadata
+            self._meta_cache.move_to_end(key)
+            if len(self._meta_cache) > META_CACHE_SIZE:
+                self._meta_cache.popitem(last=False)
+    
+    def _update_recent_rating(self, file_path: str, old_stat: os.stat_result,
+                              stat: os.stat_result, rating: int):
+        """写入评分后把内存中的元数据移到文件的新状态下，不修改已交给调用方的字典"""
+        with self._meta_cache_lock:
+            metadata = self._meta_cache.pop((file_path, old_stat.st_mtime_ns, old_stat.st_size), None)
+        if metadata is not None:
+            self._remember_metadata(file_path, stat, dict(metadata, rating=rating, file_size=stat.st_size,
+                                                          modified_time=stat.st_mtime))
+    
+    def extract_metadata(self, file_path: str, stat: Optional[os.stat_result] = None) -> Dict:
+        """提取图片元数据
+        
+        Args:
+            file_path: 图片文件路径
+            stat: 调用方已获取的os.stat结果（如DirEntry.stat()），传入时不再重复stat
+        """
+        # 只stat一次，缓存键、文件大小和修改时间都使用同一结果
+        if stat is None:
+            stat = os.stat(file_path)
+        
+        # 同一文件在浏览时会反复请求（缩略图、详情、评分），先查内存
+        recent = self._recall_metadata(file_path, stat)
+        if recent is not None:
+            return recent
+        
         cache_dir = self.get_cache_dir(file_path)
-        file_hash = self.get_file_hash(file_path)
-        metadata_path = os.path.join(cache_dir, f"meta_{file_hash}.json")
+        file_hash = self.get_file_hash(file_path, stat)
         
-        # 强制打印调试信息到stderr，确保能被看到
-        import sys
-        print("\n========== extract_metadata 被调用 ==========", file=sys.stderr)
-        print(f"文件路径: {file_path}", file=sys.stderr)
-        print(f"缓存文件路径: {metadata_path}", file=sys.stderr)
-        print(f"缓存文件存在: {os.path.exists(metadata_path)}", file=sys.stderr)
+        # 缓存键只由内容决定，记录按文件名区分；再核对大小和修改时间，防止返回文件修改前的元数据
+        cached_metadata = self._load_cached_metadata(cache_dir, file_hash, os.path.basename(file_path))
+        if cached_metadata is not None and not metadata_matches_stat(cached_metadata, file_path, stat):
+            cached_metadata = None
+        if cached_metadata is not None:
+            self._remember_metadata(file_path, stat, cached_metadata)
+            return cached_metadata
         
-        if os.path.exists(metadata_path):
-            try:
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    cached_metadata = json.load(f)
-                    print(f"从缓存读取到的rating: {cached_metadata.get('rating', 'Not found')}", file=sys.stderr)
-                    return cached_metadata
-            except Exception as e:
-                print(f"加载缓存的元数据失败 {file_path}: {e}", file=sys.stderr)
+        # 内存和数据库中都没有该文件的记录，直接从文件读取评分
+        rating_value = get_rating(file_path)
+        metadata = self._read_metadata(file_path, stat, rating_value)
+        logger.debug("提取元数据: %s 评分: %s", file_path, rating_value)
+        self._remember_metadata(file_path, stat, metadata)
+        
+        # 保存元数据缓存
+        try:
+            self._save_cached_metadata(cache_dir, file_hash, metadata)
+        except Exception as e:
+            logger.warning("保存元数据缓存失败 %s: %s", file_path, e)
         
-        # 打印WIN32_AVAILABLE状态
-        print(f"WIN32_AVAILABLE: {WIN32_AVAILABLE}", file=sys.stderr)
+        return metadata
+    
+    def extract_metadata_batch(self, file_paths: List[str]) -> Dict[str, Dict]:
+        """批量提取图片元数据，返回 {文件路径: 元数据}
         
-        # 直接测试get_windows_rating方法
-        print("调用get_windows_rating...", file=sys.stderr)
-        rating_value = self.get_windows_rating(file_path)
-        print(f"get_windows_rating返回值: {rating_value}", file=sys.stderr)
+        按所在目录分组，每组用一次IN查询读取缓存，未命中的文件用一条exiftool命令读取评分，
+        新提取的元数据在一个事务中写入数据库。无法访问的文件不在结果中
+        """
+        groups = {}
+        for file_path in file_paths:
+            groups.setdefault(os.path.dirname(file_path), []).append(file_path)
         
+        result = {}
+        for paths in groups.values():
+            for start in range(0, len(paths), META_BATCH_SIZE):
+                items = []
+                for file_path in paths[start:start + META_BATCH_SIZE]:
+                    try:
+                        items.append((file_path, os.stat(file_path)))
+                    except OSError as e:
+                        logger.warning("读取图片信息失败 %s: %s", file_path, e)
+                if not items:
+                    continue
+                
+                cache_dir = self.get_cache_dir(items[0][0])
+                hashes = self.get_file_hashes(items)
+                cached_batch = self._load_cached_metadata_many(cache_dir, hashes)
+                misses = []
+                for (file_path, stat), file_hash in zip(items, hashes):
+                    cached_metadata = cached_batch.get((file_hash, os.path.basename(file_path)))
+                    if cached_metadata is not None and metadata_matches_stat(cached_metadata, file_path, stat):
+                        result[file_path] = cached_metadata
+                        self._remember_metadata(file_path, stat, cached_metadata)
+                    else:
+                        misses.append((file_path, stat, file_hash))
+                if not misses:
+                    continue
+                
+                ratings = get_ratings([file_path for file_path, _, _ in misses])
+                rows = []
+                for file_path, stat, file_hash in misses:
+                    metadata = self._read_metadata(file_path, stat, ratings.get(file_path, 0))
+                    result[file_path] = metadata
+                    self._remember_metadata(file_path, stat, metadata)
+                    rows.append(metadata_to_row(file_hash, metadata))
+                self._save_cached_metadata_many(cache_dir, rows)
+        return result
+    
+    def _read_metadata(self, file_path: str, stat: os.stat_result, rating: int) -> Dict:
+        """从图片文件读取元数据（不读写缓存），评分由调用方提供"""
+        # 扩展名只截取一次，格式判断和RAW分支共用
+        file_ext = os.path.splitext(file_path)[1].lower()
         metadata = {
             'filename': os.path.basename(file_path),
-            'file_size': os.path.getsize(file_path),
-            'modified_time': os.path.getmtime(file_path),
-            'rating': rating_value,
+            'file_size': stat.st_size,
+            'modified_time': stat.st_mtime,
+            'rating': rating,
             'exif': {},
-            'is_raw': self.is_raw_format(file_path)
+            'is_raw': file_ext in RAW_EXTS
         }
         
-        print(f"构造的metadata中的rating: {metadata['rating']}", file=sys.stderr)
-        print("===========================================", file=sys.stderr)
-        
         try:
             # 提取EXIF信息
             if not metadata['is_raw']:
-                image = Image.open(file_path)
-                exif_dict = image._getexif()
-                
-                if exif_dict:
-                    for tag_id, value in exif_dict.items():
-                        tag = TAGS.get(tag_id, tag_id)
-                        # 确保所有值都可以序列化
-                        try:
-                            metadata['exif'][str(tag)] = str(value)
-                        except (TypeError, ValueError):
-                            metadata['exif'][str(tag)] = 'N/A'
+                # 只读取需要的标签，不再把MakerNote等所有标签都转换为字符串
+                # getexif对PNG、TIFF等格式同样可用，不像_getexif只支持JPEG
+                with Image.open(file_path) as image:
+                    exif = image.getexif()
+                    if exif:
+                        exif_ifd = exif.get_ifd(EXIF_IFD_POINTER)
+                        for tag_id, tag in PIL_EXIF_TAGS.items():
+                            value = exif.get(tag_id)
+                            if value is None:
+                                value = exif_ifd.get(tag_id)
+                            if value is None:
+                                continue
+                            # 确保所有值都可以序列化
+                            try:
+                                metadata['exif'][tag] = exif_value_text(value)
+                            except (TypeError, ValueError):
+                                metadata['exif'][tag] = 'N/A'
             else:
                 # RAW文件使用exifread
-                file_ext = os.path.splitext(file_path)[1].lower()
-                print(f"尝试提取RAW文件元数据: {file_path}")
-                print(f"  文件扩展名: {file_ext}")
+                logger.debug("尝试提取RAW文件元数据: %s (%s)", file_path, file_ext)
                 
                 # 添加RAW文件特定信息
                 metadata['file_format'] = file_ext
                 
                 try:
-                    with open(file_path, 'rb') as f:
-                        tags = exifread.process_file(f)
+                    # 以只读方式映射文件，exifread在各个IFD之间跳转时直接读取映射的页面，
+                    # 不再经过缓冲文件对象的多次read系统调用和内存拷贝
+                    with open(file_path, 'rb') as f, \
+                            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                        # details=False跳过MakerNote等不需要的详细信息
+                        tags = exifread.process_file(mapped_file, details=False)
                         
                         if not tags:
-                            print(f"  警告: 无法从RAW文件中提取任何EXIF标签")
+                            logger.warning("无法从RAW文件中提取任何EXIF标签")
                         else:
                             # 记录标签数量
-                            print(f"  成功提取到 {len(tags)} 个EXIF标签")
+                            logger.debug("成功提取到 %s 个EXIF标签", len(tags))
                             
                             # 检查是否有尺寸相关标签
                             has_size_info = any(tag in tags for tag in ['EXIF ExifImageWidth', 'EXIF ExifImageLength', 'Image Width', 'Image Length'])
                             if has_size_info:
-                                print("  文件包含尺寸信息标签")
+                                logger.debug("文件包含尺寸信息标签")
                                 # 尝试提取尺寸信息
                                 for tag in ['EXIF ExifImageWidth', 'EXIF ExifImageLength', 'Image Width', 'Image Length']:
                                     if tag in tags:
@@ -616,210 +2069,356 @@ class ImageProcessor:
                                         except (ValueError, TypeError):
                                             continue
                             else:
-                                print("  文件不包含尺寸信息标签")
+                                logger.debug("文件不包含尺寸信息标签")
                             
-                            # 保存标签（排除大尺寸的缩略图数据）
-                            for tag in tags.keys():
-                                if tag not in ['JPEGThumbnail', 'TIFFThumbnail', 'Filename', 'EXIF MakerNote']:
-                                    try:
-                                        # 对于大的值，截断显示
-                                        tag_value = str(tags[tag])
-                                        if len(tag_value) > 500:
-                                            tag_value = tag_value[:500] + "... [截断显示]"
-                                        metadata['exif'][tag] = tag_value
-                                    except Exception as e:
-                                        print(f"  保存标签 {tag} 失败: {e}")
+                            # 只保存需要的标签，使用与PIL相同的字段名
+                            for raw_tag, tag in RAW_EXIF_TAGS.items():
+                                if raw_tag not in tags:
+                                    continue
+                                try:
+                                    # 对于大的值，截断显示
+                                    metadata['exif'][tag] = exif_value_text(tags[raw_tag])
+                                except Exception as e:
+                                    logger.warning("保存标签 %s 失败: %s", raw_tag, e)
                 except Exception as e:
-                    print(f"  读取RAW文件失败: {e}")
+                    logger.warning("读取RAW文件失败: %s", e)
                     # 即使失败，我们已经添加了基本的文件格式信息
-        
-            # 保存元数据缓存
-            try:
-                with open(metadata_path, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, indent=2, ensure_ascii=False)
-            except Exception as e:
-                print(f"保存元数据缓存失败 {file_path}: {e}")
-                
         except Exception as e:
-            print(f"提取元数据失败 {file_path}: {e}")
+            logger.warning("提取元数据失败 %s: %s", file_path, e)
             # 添加错误信息到元数据
             metadata['error'] = str(e)
         
         return metadata
     
-    def fix_image_orientation(self, image: Image.Image) -> Image.Image:
-        """根据EXIF自动修正图片方向（使用Pillow的exif_transpose，推荐方法）"""
+    def get_image_orientation(self, image: Image.Image) -> int:
+        """读取EXIF方向，不携带方向信息的格式直接返回1"""
+        if image.format not in ORIENTATION_FORMATS:
+            return 1
         try:
-            from PIL import ImageOps
-            image = ImageOps.exif_transpose(image)
+            return image.getexif().get(EXIF_ORIENTATION, 1)
         except Exception as e:
-            print(f"处理图片方向时出错 (exif_transpose): {e}")
-        return image
+            logger.warning("读取图片方向时出错: %s", e)
+            return 1
+
+    def fix_image_orientation(self, image: Image.Image) -> Image.Image:
+        """根据EXIF方向修正图片方向"""
+        method = ORIENTATION_TRANSPOSE.get(self.get_image_orientation(image))
+        if method is None:
+            return image
+        return image.transpose(method)
     
     def clean_all_thumbnails(self):
         """清理所有图片目录下的缩略图缓存文件"""
         try:
             # 获取所有配置的图片目录
             image_dirs = self.config.config.get('image_directories', [])
+            removed_count = 0
             
             for image_dir in image_dirs:
                 if not os.path.exists(image_dir):
                     continue
                 
                 # 遍历目录查找所有.album_cache文件夹
-                for root, dirs, files in os.walk(image_dir):
-                    if '.album_cache' in dirs:
-                        cache_dir = os.path.join(root, '.album_cache')
-                        
-                        # 删除所有thumb_开头的缩略图文件
-                        if os.path.exists(cache_dir):
-                            for file in os.listdir(cache_dir):
-                                if file.startswith('thumb_'):
-                                    file_path = os.path.join(cache_dir, file)
-                                    try:
-                                        os.remove(file_path)
-                                        print(f"已删除旧缩略图: {file_path}")
-                                    except Exception as e:
-                                        print(f"删除缩略图失败 {file_path}: {e}")
-            
-            print("所有旧缩略图缓存已清理完成")
+                for root, _, has_cache_dir in walk_folders(image_dir):
+                    if not has_cache_dir:
+                        continue
+                    cache_dir = os.path.join(root, CACHE_DIR_NAME)
+                    
+                    # 删除所有thumb_开头的缩略图文件
+                    try:
+                        with os.scandir(cache_dir) as it:
+                            # DirEntry自带文件类型，不需要额外stat
+                            thumb_paths = [entry.path for entry in it
+                                           if entry.name.startswith('thumb_') and entry.is_file(follow_symlinks=False)]
+                    except OSError as e:
+                        logger.warning("读取缓存目录失败 %s: %s", cache_dir, e)
+                        continue
+                    dir_removed = 0
+                    for file_path in thumb_paths:
+                        try:
+                            os.unlink(file_path)
+                            dir_removed += 1
+                        except OSError as e:
+                            logger.warning("删除缩略图失败 %s: %s", file_path, e)
+                    logger.debug("已删除 %s 个旧缩略图: %s", dir_removed, cache_dir)
+                    removed_count += dir_removed
+            
+            # 缓存文件已被删除，下次访问时重新扫描缓存目录
+            self._cache_listing.clear()
+            logger.info("所有旧缩略图缓存已清理完成，共删除 %s 个文件", removed_count)
         except Exception as e:
-            print(f"清理缓存时发生错误: {e}")
+            logger.warning("清理缓存时发生错误: %s", e)
     
     def clean_all_cache(self):
         """清理所有图片目录下的缓存文件"""
+        # 先关闭元数据数据库连接，否则Windows下无法删除缓存目录
+        self._close_meta_dbs()
         cleaned_count = 0
         for directory in self.config.config['image_directories']:
             if os.path.exists(directory):
-                for root, dirs, files in os.walk(directory):
-                    if '.album_cache' in dirs:
-                        cache_path = os.path.join(root, '.album_cache')
+                for root, _, has_cache_dir in walk_folders(directory):
+                    if has_cache_dir:
+                        cache_path = os.path.join(root, CACHE_DIR_NAME)
                         try:
                             shutil.rmtree(cache_path)
                             cleaned_count += 1
-                            print(f"已删除缓存目录: {cache_path}")
+                            logger.debug("已删除缓存目录: %s", cache_path)
                         except Exception as e:
-                            print(f"删除缓存目录失败 {cache_path}: {e}")
-        print(f"总共清理了 {cleaned_count} 个缓存目录")
+                            logger.warning("删除缓存目录失败 %s: %s", cache_path, e)
+        self._cache_listing.clear()
+        self._created_cache_dirs.clear()
+        self._unwritable_cache_dirs.clear()
+        logger.info("总共清理了 %s 个缓存目录", cleaned_count)
     
     def get_windows_rating(self, file_path: str) -> int:
         """获取图片星级评分
         
-        使用exiftool直接从图片文件中读取星级评分
+        依次查找内存中的元数据和元数据数据库（按文件名、大小、修改时间核对），
+        文件变化过或没有缓存时才从图片文件中读取
         """
         try:
-            if not os.path.exists(file_path):
-                print(f"错误: 文件不存在 - {file_path}")
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                logger.warning("文件不存在 - %s", file_path)
                 return 0
             
-            # 直接使用exiftool获取评分
+            recent = self._recall_metadata(file_path, stat)
+            if recent is not None:
+                return recent.get('rating', 0)
+            
+            # 文件未变化时直接使用元数据数据库中记录的评分
+            cached_metadata = self._load_cached_metadata(self.get_cache_dir(file_path),
+                                                         self.get_file_hash(file_path, stat),
+                                                         os.path.basename(file_path))
+            if cached_metadata is not None and metadata_matches_stat(cached_metadata, file_path, stat):
+                return cached_metadata.get('rating', 0)
+            
+            # 没有缓存时从文件读取
             rating_value = get_rating(file_path)
-            print(f"从文件获取评分: {rating_value} 对于文件: {file_path}")
+            logger.debug("从文件获取评分: %s 对于文件: %s", rating_value, file_path)
             return rating_value
         except Exception as e:
-            print(f"获取星级评分时出错: {e}")
+            logger.warning("获取星级评分时出错: %s", e)
             return 0
     
     def set_windows_rating(self, file_path: str, rating: int) -> bool:
         """设置图片星级评分
         
         使用exiftool直接将星级评分写入图片文件
-        并同步更新缓存目录中的meta_xx.json文件
+        并同步更新缓存目录中的元数据数据库
         """
         try:
             # 验证参数
             if not isinstance(rating, int) or rating < 0 or rating > 5:
-                print(f"错误: 无效的星级评分 (必须是0-5之间的整数) - {rating}")
+                logger.warning("无效的星级评分 (必须是0-5之间的整数) - %s", rating)
                 return False
             
-            if not os.path.exists(file_path):
-                print(f"错误: 文件不存在 - {file_path}")
+            # 写入评分会改变文件的修改时间和大小，先记下原来的缓存键（同时检查文件是否存在）
+            try:
+                old_stat = os.stat(file_path)
+            except FileNotFoundError:
+                logger.warning("文件不存在 - %s", file_path)
                 return False
+            cache_dir = self.get_cache_dir(file_path)
+            old_hash = self.get_file_hash(file_path, old_stat)
             
             # 使用exiftool设置评分到原图
             rating_set = set_rating(file_path, rating)
             
-            # 更新元数据缓存
+            # 更新元数据缓存，并把记录移到新的缓存键下
             if rating_set:
                 try:
-                    cache_dir = self.get_cache_dir(file_path)
-                    file_hash = self.get_file_hash(file_path)
-                    metadata_path = os.path.join(cache_dir, f"meta_{file_hash}.json")
-                    
-                    if os.path.exists(metadata_path):
-                        with open(metadata_path, 'r', encoding='utf-8') as f:
-                            metadata = json.load(f)
-                        metadata['rating'] = rating
-                        with open(metadata_path, 'w', encoding='utf-8') as f:
-                            json.dump(metadata, f, indent=2, ensure_ascii=False)
-                        print(f"成功更新元数据缓存: {metadata_path}")
+                    stat = os.stat(file_path)
+                    new_hash = self.get_file_hash(file_path, stat)
+                    self._update_recent_rating(file_path, old_stat, stat, rating)
+                    # 评分只改变元数据不改变像素，缩略图和预览图立即改到新缓存键下，不必重新生成；
+                    # 数据库记录随后在_flush_rating_updates中改到新缓存键下
+                    # 内容相同的其他文件仍在使用原缓存键时不改名，本文件的缓存稍后重新生成
+                    if new_hash != old_hash and not self._cache_key_shared(cache_dir, file_path, old_hash):
+                        self._rename_cache_files(cache_dir, self._get_cache_listing(cache_dir),
+                                                 old_hash, new_hash)
+                    self._schedule_rating_update(cache_dir, file_path, old_hash, new_hash, rating, stat)
                 except Exception as e:
-                    print(f"更新元数据缓存失败: {e}")
+                    logger.warning("更新元数据缓存失败: %s", e)
                     # 即使缓存更新失败，评分设置仍然成功
             
             return rating_set
         except Exception as e:
-            print(f"设置星级失败 {file_path}: {e}")
+            logger.warning("设置星级失败 %s: %s", file_path, e)
             return False
     
+    def _group_image_files(self, directory: str, file_names: List[str]) -> List[Tuple[str, bool, bool]]:
+        """按文件名（不含扩展名）对同一目录下的图片分组
+        
+        同名的JPG和RAW只保留一项并优先显示JPG，一次遍历即可完成配对，
+        不需要再为每个文件探测同名JPG是否存在
+        
+        Returns:
+            List[Tuple[str, bool, bool]]: (显示文件路径, 是否有RAW, 是否有JPG) 列表
+        """
+        # 目录前缀只拼接一次，每个文件直接字符串相加，与os.scandir的entry.path结果相同
+        prefix = os.path.join(directory, '')
+        return [
+            (prefix + display_name, has_raw, has_jpg)
+            for display_name, has_raw, has_jpg in classify_image_names(file_names, self._ext_roles)
+        ]
+    
+    def _build_image_info(self, display_path: str, directory: str, has_raw: bool, has_jpg: bool,
+                          stat: Optional[os.stat_result] = None, file_hash: Optional[str] = None,
+                          cached_batch: Optional[Dict[Tuple[str, str], Dict]] = None) -> Dict:
+        """构建图片的基本信息，只读取已有的缓存，不生成缩略图、预览图或提取元数据
+        
+        缩略图、预览图和元数据在真正需要时（异步任务或接口请求）再生成
+        
+        Args:
+            stat: 调用方已获取的文件状态，为None时在这里stat
+            file_hash: 调用方已计算的缓存键，为None时在这里计算
+            cached_batch: _load_cached_metadata_many预先批量读取的元数据，为None时单独查询
+        """
+        # 生成缓存路径，但不立即生成缓存或提取元数据
+        if stat is None:
+            stat = os.stat(display_path)
+        cache_dir = self.get_cache_dir(display_path)
+        if file_hash is None:
+            file_hash = self.get_file_hash(display_path, stat)
+        thumbnail_name = f"thumb_{file_hash}.jpg"
+        preview_name = f"preview_{file_hash}.jpg"
+        thumbnail_path = os.path.join(cache_dir, thumbnail_name)
+        preview_path = os.path.join(cache_dir, preview_name)
+        # 缓存目录内容未变化时只需stat一次目录，之后是集合查找
+        cache_listing = self._get_cache_listing(cache_dir)
+        thumbnail_exists = thumbnail_name in cache_listing
+        preview_exists = preview_name in cache_listing
+        
+        # 构建基本图片信息
+        # 注意：这里不调用extract_metadata，只提供基本信息
+        # 分组时已按扩展名分类：没有同名JPG而有RAW时，显示的文件就是RAW
+        is_raw = has_raw and not has_jpg
+        
+        # 只获取文件名、文件大小和修改时间等基本信息
+        basic_info = {
+            'filename': os.path.basename(display_path),
+            'file_size': stat.st_size,
+            'modified_time': stat.st_mtime,
+            'rating': 0,  # 默认评分
+            'exif': {},
+            'is_raw': is_raw
+        }
+        
+        # 如果元数据缓存已存在，快速加载
+        if cached_batch is not None:
+            cached_metadata = cached_batch.get((file_hash, basic_info['filename']))
+        else:
+            cached_metadata = self._load_cached_metadata(cache_dir, file_hash, basic_info['filename'])
+        if cached_metadata is not None and not metadata_matches_stat(cached_metadata, display_path, stat):
+            cached_metadata = None
+        if cached_metadata is None:
+            # 刚修改过评分的文件，数据库可能还未写入
+            cached_metadata = self._recall_metadata(display_path, stat)
+        
+        image_info = {
+            'file_path': display_path,
+            'relative_path': relative_path(display_path, directory),
+            'thumbnail_path': thumbnail_path if thumbnail_exists else None,
+            'preview_path': preview_path if preview_exists else None,
+            'metadata': cached_metadata or basic_info,
+            'has_raw': has_raw,
+            'has_jpg': has_jpg,
+            'thumbnail_exists': thumbnail_exists,
+            'preview_exists': preview_exists,
+            'metadata_exists': cached_metadata is not None
+        }
+        
+        return image_info
+    
     def scan_directory(self, directory: str) -> List[Dict]:
-        """扫描目录中的图片文件"""
+        """递归扫描目录中的图片文件
+        
+        只返回基本信息和已有的缓存，不会为每张图片解码生成缩略图和预览图
+        """
         images = []
         
-        for root, dirs, files in os.walk(directory):
-            # 排除以.开头的隐藏目录，避免扫描缓存文件夹
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            
-            for file in files:
-                file_path = os.path.join(root, file)
-                
-                # 跳过隐藏文件夹中的文件
-                if '.album_cache' in file_path or any(part.startswith('.') for part in file_path.split(os.sep)):
-                    continue
-                
-                if self.is_supported_format(file_path):
-                    # 检查是否有同名的JPG和RAW文件
-                    base_name = os.path.splitext(file_path)[0]
-                    jpg_path = None
-                    raw_path = None
-                    
-                    # 查找同名文件
-                    for ext in ['.jpg', '.jpeg']:
-                        potential_jpg = base_name + ext
-                        if os.path.exists(potential_jpg):
-                            jpg_path = potential_jpg
-                            break
-                    
-                    if self.is_raw_format(file_path):
-                        raw_path = file_path
-                    
-                    # 根据规则决定显示哪个文件
-                    display_path = file_path
-                    if jpg_path and raw_path:
-                        display_path = jpg_path  # 优先显示JPG
-                    elif jpg_path:
-                        display_path = jpg_path
-                    elif raw_path:
-                        display_path = raw_path
-                    
-                    # 避免重复添加
-                    if not any(img['file_path'] == display_path for img in images):
-                        metadata = self.extract_metadata(display_path)
-                        
-                        image_info = {
-                            'file_path': display_path,
-                            'relative_path': os.path.relpath(display_path, directory),
-                            'thumbnail_path': self.generate_thumbnail(display_path),
-                            'preview_path': self.generate_preview(display_path),
-                            'metadata': metadata,
-                            'has_raw': raw_path is not None,
-                            'has_jpg': jpg_path is not None
-                        }
-                        
-                        images.append(image_info)
+        # walk_folders不会进入以.开头的隐藏目录（包括缓存文件夹），也不返回隐藏文件
+        for root, file_entries, _ in walk_folders(directory):
+            groups = self._group_image_files(root, file_entries)
+            images.extend(info for _, info in self._iter_image_infos(root, groups, directory, file_entries))
         
         return images
     
+    def find_duplicates(self, directories: List[str]) -> Dict[str, List[str]]:
+        """递归查找内容完全相同的图片
+        
+        先按文件大小分组，只有大小相同的文件才读取全部内容计算哈希，
+        图库中大小相同的文件很少，绝大多数文件不需要读取
+        
+        Returns:
+            Dict[str, List[str]]: {内容哈希: 内容相同的文件路径列表}，只包含至少两个文件的组
+        """
+        paths_by_size = defaultdict(list)
+        for directory in directories:
+            for _, file_entries, _ in walk_folders(directory):
+                for name, entry in file_entries.items():
+                    if not self.is_supported_format(name):
+                        continue
+                    try:
+                        paths_by_size[entry.stat().st_size].append(entry.path)
+                    except OSError as e:
+                        logger.warning("读取图片信息失败 %s: %s", entry.path, e)
+        
+        duplicates = {}
+        for paths in paths_by_size.values():
+            if len(paths) < 2:
+                continue
+            paths_by_hash = defaultdict(list)
+            for path in paths:
+                try:
+                    paths_by_hash[hash_file_content(path)].append(path)
+                except OSError as e:
+                    logger.warning("读取图片内容失败 %s: %s", path, e)
+            duplicates.update((key, group) for key, group in paths_by_hash.items() if len(group) > 1)
+        return duplicates
+    
+    def _iter_image_infos(self, folder: str, groups, directory: str,
+                          file_entries: Optional[Dict[str, os.DirEntry]] = None) -> Iterator[Tuple[str, Dict]]:
+        """按批构建同一文件夹中图片的信息，每批只查询一次元数据数据库
+        
+        Args:
+            folder: 图片所在文件夹
+            groups: _group_image_files返回的 (显示路径, 是否有RAW, 是否有JPG)
+            directory: 计算相对路径的基准目录
+            file_entries: walk_folders返回的 {文件名: DirEntry}，提供时直接使用其stat结果
+        
+        Yields:
+            Tuple[str, Dict]: (显示路径, 图片信息)，无法访问的文件会被跳过
+        """
+        groups = iter(groups)
+        while True:
+            batch = []
+            for display_path, has_raw, has_jpg in groups:
+                try:
+                    if file_entries is not None:
+                        stat = file_entries[os.path.basename(display_path)].stat()
+                    else:
+                        stat = os.stat(display_path)
+                except OSError as e:
+                    # 文件在扫描过程中被删除或无法访问，跳过该文件
+                    logger.warning("读取图片信息失败 %s: %s", display_path, e)
+                    continue
+                batch.append((display_path, has_raw, has_jpg, stat))
+                if len(batch) >= META_BATCH_SIZE:
+                    break
+            if not batch:
+                return
+            
+            # 同一文件夹的图片共用一个缓存目录
+            cache_dir = self.get_cache_dir(batch[0][0])
+            hashes = self.get_file_hashes([(item[0], item[3]) for item in batch])
+            cached_batch = self._load_cached_metadata_many(cache_dir, hashes)
+            for (display_path, has_raw, has_jpg, stat), file_hash in zip(batch, hashes):
+                yield display_path, self._build_image_info(display_path, directory, has_raw, has_jpg,
+                                                           stat, file_hash, cached_batch)
+    
     def scan_current_directory(self, directory: str) -> List[Dict]:
         """扫描当前目录中的图片文件（不递归子目录）
         
@@ -829,159 +2428,251 @@ class ImageProcessor:
         3. 所有缩略图和预览图全部异步生成，不阻塞主流程
         4. 返回不完整的图片信息，客户端后续可以异步加载
         """
-        images = []
+        return list(self.iter_current_directory(directory))
+    
+    def iter_current_directory(self, directory: str) -> Iterator[Dict]:
+        """逐个生成当前目录中的图片信息（不递归子目录）
+        
+        调用方可以提前停止迭代，只有已经取出的图片才会加入异步缓存生成队列
+        """
+        # 预先检查目录权限，而不是用宽泛的try包住整个扫描过程
+        if not os.access(directory, os.R_OK | os.X_OK):
+            logger.warning("权限不足，无法访问目录: %s", directory)
+            return
+        
+        # 快速扫描阶段：只收集基本文件信息，不做耗时操作
+        # 跳过隐藏文件，只处理文件，不处理目录
+        listing = self._list_directory(directory)
+        if listing is None:
+            return
+        file_names = listing[0]
+        
         image_paths = []
+        try:
+            groups = self._group_image_files(directory, file_names)
+            for display_path, image_info in self._iter_image_infos(directory, groups, directory):
+                image_paths.append(display_path)
+                yield image_info
+        finally:
+            # 迭代结束或被提前关闭时，把已取出图片的处理任务加入队列，不阻塞返回
+            self._enqueue_cache_tasks(image_paths)
+    
+    def _list_directory(self, directory: str) -> Optional[Tuple[List[str], List[str]]]:
+        """列出目录中的非隐藏文件和子目录名称
         
+        结果按目录修改时间缓存，目录内容未变化时只需一次stat
+        
+        Returns:
+            Optional[Tuple[List[str], List[str]]]: (文件名列表, 子目录名列表)，目录无法读取时返回None
+        """
+        listing = self._list_directory_with_mtime(directory)
+        if listing is None:
+            return None
+        return listing[1], listing[2]
+    
+    def _list_directory_with_mtime(self, directory: str) -> Optional[Tuple[int, List[str], List[str]]]:
+        """同_list_directory，额外返回列表对应的目录修改时间"""
         try:
-            # 快速扫描阶段：只收集基本文件信息，不做耗时操作
-            for file in os.listdir(directory):
-                if file.startswith('.'):  # 跳过隐藏文件
-                    continue
-                         
-                file_path = os.path.join(directory, file)
-                
-                # 只处理文件，不处理目录
-                if not os.path.isfile(file_path):
-                    continue
-                
-                if self.is_supported_format(file_path):
-                    # 检查是否有同名的JPG和RAW文件
-                    base_name = os.path.splitext(file_path)[0]
-                    jpg_path = None
-                    raw_path = None
-                    
-                    # 查找同名文件
-                    for ext in ['.jpg', '.jpeg']:
-                        potential_jpg = base_name + ext
-                        if os.path.exists(potential_jpg):
-                            jpg_path = potential_jpg
-                            break
-                    
-                    if self.is_raw_format(file_path):
-                        raw_path = file_path
-                    
-                    # 根据规则决定显示哪个文件
-                    display_path = file_path
-                    if jpg_path and raw_path:
-                        display_path = jpg_path  # 优先显示JPG
-                    elif jpg_path:
-                        display_path = jpg_path
-                    elif raw_path:
-                        display_path = raw_path
-                    
-                    # 避免重复添加
-                    if not any(img['file_path'] == display_path for img in images):
-                        # 生成缓存路径，但不立即生成缓存或提取元数据
-                        cache_dir = self.get_cache_dir(display_path)
-                        file_hash = self.get_file_hash(display_path)
-                        thumbnail_path = os.path.join(cache_dir, f"thumb_{file_hash}.jpg")
-                        preview_path = os.path.join(cache_dir, f"preview_{file_hash}.jpg")
-                        metadata_path = os.path.join(cache_dir, f"meta_{file_hash}.json")
-                        
-                        # 构建基本图片信息
-                        # 注意：这里不调用extract_metadata，只提供基本信息
-                        is_raw = self.is_raw_format(display_path)
-                        
-                        # 只获取文件名、文件大小和修改时间等基本信息
-                        basic_info = {
-                            'filename': os.path.basename(display_path),
-                            'file_size': os.path.getsize(display_path),
-                            'modified_time': os.path.getmtime(display_path),
-                            'rating': 0,  # 默认评分
-                            'exif': {},
-                            'is_raw': is_raw
-                        }
-                        
-                        # 如果元数据缓存已存在，快速加载
-                        cached_metadata = None
-                        if os.path.exists(metadata_path):
-                            try:
-                                with open(metadata_path, 'r', encoding='utf-8') as f:
-                                    cached_metadata = json.load(f)
-                            except Exception as e:
-                                print(f"加载缓存的元数据失败 {display_path}: {e}")
-                        
-                        image_info = {
-                            'file_path': display_path,
-                            'relative_path': os.path.relpath(display_path, directory),
-                            'thumbnail_path': thumbnail_path if os.path.exists(thumbnail_path) else None,
-                            'preview_path': preview_path if os.path.exists(preview_path) else None,
-                            'metadata': cached_metadata or basic_info,
-                            'has_raw': raw_path is not None,
-                            'has_jpg': jpg_path is not None,
-                            'thumbnail_exists': os.path.exists(thumbnail_path),
-                            'preview_exists': os.path.exists(preview_path),
-                            'metadata_exists': cached_metadata is not None
-                        }
-                        
-                        images.append(image_info)
-                        image_paths.append(display_path)
-            
-            # 异步处理阶段：将所有图片的处理任务加入队列，不阻塞返回
-            # 1. 首先添加所有元数据提取任务
-            for image_path in image_paths:
-                self.cache_queue.put({'type': 'metadata', 'file_path': image_path})
-            
-            # 2. 然后添加所有缩略图生成任务
-            for image_path in image_paths:
-                self.cache_queue.put({'type': 'thumbnail', 'file_path': image_path})
-            
-            # 3. 最后添加所有预览图生成任务
-            for image_path in image_paths:
-                self.cache_queue.put({'type': 'preview', 'file_path': image_path})
-        except PermissionError:
-            print(f"权限不足，无法访问目录: {directory}")
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError as e:
+            logger.warning("扫描目录失败 %s: %s", directory, e)
+            return None
+        
+        cached = self._recall_dir_entry(self._dir_listing_cache, directory)
+        if cached is not None and cached[1][0] == mtime_ns:
+            return cached[1]
+        
+        file_names = []
+        dir_names = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_file():
+                        file_names.append(entry.name)
+                    elif entry.is_dir():
+                        dir_names.append(entry.name)
+        except OSError as e:
+            logger.warning("扫描目录失败 %s: %s", directory, e)
+            return None
+        
+        listing = (mtime_ns, file_names, dir_names)
+        self._remember_dir_entry(self._dir_listing_cache, directory, listing)
+        return listing
+    
+    def _recall_dir_entry(self, cache: OrderedDict, directory: str) -> Optional[Tuple[float, object]]:
+        """从目录列表或无图片目录树缓存中取出未过期的记录 (记录时间, 内容)"""
+        with self._dir_cache_lock:
+            entry = cache.get(directory)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > DIR_CACHE_TTL:
+                del cache[directory]
+                return None
+            cache.move_to_end(directory)
+            return entry
+    
+    def _remember_dir_entry(self, cache: OrderedDict, directory: str, value, recorded_at: Optional[float] = None):
+        """记录目录列表或无图片目录树，超过DIR_CACHE_SIZE时丢弃最久未使用的"""
+        if recorded_at is None:
+            recorded_at = time.monotonic()
+        with self._dir_cache_lock:
+            cache[directory] = (recorded_at, value)
+            cache.move_to_end(directory)
+            while len(cache) > DIR_CACHE_SIZE:
+                cache.popitem(last=False)
+    
+    def prefetch_sibling_directories(self, directory: str):
+        """在后台预取同级目录的列表，用户切换到相邻目录时可直接使用缓存
+        
+        只预热目录列表缓存，不生成缩略图等缓存文件
+        """
+        directory = os.path.normpath(directory)
+        parent = os.path.dirname(directory)
+        listing = self._list_directory(parent)
+        if listing is None:
+            return
+        
+        for dir_name in listing[1]:
+            sibling = os.path.join(parent, dir_name)
+            if sibling == directory:
+                continue
+            # 排队的预取任务已满时放弃剩余目录，避免大目录下堆积无用任务
+            if not self._prefetch_slots.acquire(blocking=False):
+                break
+            try:
+                self._prefetch_pool.submit(self._warm_directory, sibling)
+            except RuntimeError:
+                # 线程池已关闭
+                self._prefetch_slots.release()
+                break
+    
+    def _warm_directory(self, directory: str):
+        """预取目录及其直接子目录的列表（浏览目录时会扫描每个子目录）"""
+        try:
+            listing = self._list_directory(directory)
+            if listing is not None:
+                for dir_name in listing[1]:
+                    self._list_directory(os.path.join(directory, dir_name))
         except Exception as e:
-            print(f"扫描目录失败 {directory}: {e}")
+            logger.warning("预取目录失败 %s: %s", directory, e)
+        finally:
+            self._prefetch_slots.release()
+    
+    def _enqueue_cache_tasks(self, image_paths: List[str]):
+        """将图片的元数据、缩略图和预览图生成任务加入异步队列
         
-        return images
-         
+        每段图片先排缩略图再排元数据，界面上的缩略图尽早出现；同一段的元数据任务连续排队，
+        工作线程仍可合并为一次批量提取。预览图最耗时，全部排在最后
+        """
+        for start in range(0, len(image_paths), TASK_INTERLEAVE_SIZE):
+            chunk = image_paths[start:start + TASK_INTERLEAVE_SIZE]
+            self.submit_many('thumbnail', chunk)
+            self.submit_many('metadata', chunk)
+        
+        self.submit_many('preview', image_paths)
+    
     def find_preview_image_in_subdirectories(self, directory: str) -> Optional[Dict]:
-        """在子目录中查找预览图片"""
-        try:
-            # 遍历目录下的所有子目录
-            for item in os.listdir(directory):
-                if item.startswith('.'):  # 跳过隐藏目录
+        """在子目录中查找预览图片
+        
+        用显式栈做深度优先搜索，顺序与逐层递归相同：先看子目录自身的文件，
+        没有图片再进入它的子目录。找到第一张图片立即返回
+        """
+        # 预先检查权限，没有读取权限的目录直接跳过
+        if not os.access(directory, os.R_OK | os.X_OK):
+            return None
+        
+        # 之前确认过没有图片且目录树未变化，直接返回
+        if self._known_empty_subtree(directory) is not None:
+            return None
+        
+        listing = self._list_directory_with_mtime(directory)
+        if listing is None:
+            return None
+        
+        # 每层记录 [目录, 未访问的子目录名, 搜索过的目录修改时间, 目录树是否完整搜索过, 最早的确认时间]，
+        # 全部没有图片时修改时间记录作为否定结果缓存；沿用子目录树的缓存结果时，确认时间取较早的一个
+        stack = [[directory, iter(listing[2]), {directory: listing[0]}, True, time.monotonic()]]
+        while stack:
+            frame = stack[-1]
+            folder, children, subtree_mtimes, complete, checked_at = frame
+            item = next(children, None)
+            
+            if item is None:
+                # 该目录树已搜索完毕，没有图片
+                stack.pop()
+                if complete:
+                    self._remember_dir_entry(self._empty_subtrees, folder, subtree_mtimes, checked_at)
+                if stack:
+                    parent = stack[-1]
+                    if complete:
+                        parent[2].update(subtree_mtimes)
+                        parent[4] = min(parent[4], checked_at)
+                    else:
+                        parent[3] = False
+                continue
+            
+            item_path = os.path.join(folder, item)
+            known = self._known_empty_subtree(item_path)
+            if known is not None:
+                subtree_mtimes.update(known[1])
+                frame[4] = min(frame[4], known[0])
+                continue
+            
+            item_listing = self._list_directory_with_mtime(item_path)
+            if item_listing is None:
+                frame[3] = False
+                continue
+            
+            # 先检查子目录自身是否有图片；只返回已有的缓存，缩略图由前端请求时再生成
+            for sub_item_path, has_raw, has_jpg in self._group_image_files(item_path, item_listing[1]):
+                try:
+                    return self._build_image_info(sub_item_path, directory, has_raw, has_jpg)
+                except OSError as e:
+                    logger.warning("检查子目录 %s 时出错: %s", item_path, e)
                     continue
-                        
-                item_path = os.path.join(directory, item)
-                
-                if os.path.isdir(item_path):
-                    # 先检查子目录是否有图片
-                    try:
-                        for sub_item in os.listdir(item_path):
-                            if sub_item.startswith('.'):
-                                continue
-                            
-                            sub_item_path = os.path.join(item_path, sub_item)
-                            if os.path.isfile(sub_item_path) and self.is_supported_format(sub_item_path):
-                                metadata = self.extract_metadata(sub_item_path)
-                                image_info = {
-                                    'file_path': sub_item_path,
-                                    'relative_path': os.path.relpath(sub_item_path, directory),
-                                    'thumbnail_path': self.generate_thumbnail(sub_item_path),
-                                    'preview_path': self.generate_preview(sub_item_path),
-                                    'metadata': metadata
-                                }
-                                return image_info
-                    except Exception as e:
-                        print(f"检查子目录 {item_path} 时出错: {str(e)}")
-                    
-                    # 如果子目录中没有图片，递归查找更深层次的子目录
-                    preview_image = self.find_preview_image_in_subdirectories(item_path)
-                    if preview_image:
-                        return preview_image
-        except Exception as e:
-            print(f"在子目录中查找预览图时出错: {str(e)}")
+            
+            # 子目录中没有图片，继续查找更深层次的子目录
+            stack.append([item_path, iter(item_listing[2]), {item_path: item_listing[0]}, True, time.monotonic()])
+        
+        return None
+    
+    def _known_empty_subtree(self, directory: str) -> Optional[Tuple[float, Dict[str, int]]]:
+        """检查目录树是否已确认没有图片，且未过期、其中所有目录的修改时间都未变化
+        
+        Returns:
+            Optional[Tuple[float, Dict[str, int]]]: (确认时间, {树中各目录: 修改时间ns})，不能确认时返回None
+        """
+        entry = self._recall_dir_entry(self._empty_subtrees, directory)
+        if entry is None:
+            return None
+        
+        for path, mtime_ns in entry[1].items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    break
+            except OSError:
+                break
+        else:
+            return entry
         
+        with self._dir_cache_lock:
+            self._empty_subtrees.pop(directory, None)
         return None
          
     def get_directory_preview(self, directory: str) -> Optional[Dict]:
         """获取目录的预览图片信息"""
-        # 先尝试在当前目录查找
-        current_images = self.scan_current_directory(directory)
-        if current_images:
-            return current_images[0]
+        # 先尝试在当前目录查找，只需要第一张图片，不必扫描整个目录
+        current_images = self.iter_current_directory(directory)
+        try:
+            first_image = next(current_images, None)
+        finally:
+            current_images.close()
+        # 用户接下来很可能进入相邻目录，趁界面渲染时在后台预取
+        self.prefetch_sibling_directories(directory)
+        if first_image:
+            return first_image
             
         # 如果当前目录没有图片，递归查找子目录
         return self.find_preview_image_in_subdirectories(directory)
@@ -1,7 +1,7 @@
 import sys
 import os
 from image_processor import get_rating, set_rating, ImageProcessor
-import json
+from config import Config
 
 # 确保中文显示正常
 sys.stdout.reconfigure(encoding='utf-8')
@@ -24,16 +24,11 @@ def test_rating_functions(file_path):
         updated_rating = get_rating(file_path)
         print(f"更新后评分: {updated_rating}⭐")
         
-        # 4. 检查缓存文件是否更新
-        processor = ImageProcessor({"config": {}})
-        cache_dir = processor.get_cache_dir(file_path)
-        file_hash = processor.get_file_hash(file_path)
-        metadata_path = os.path.join(cache_dir, f"meta_{file_hash}.json")
+        # 4. 检查元数据缓存是否更新
+        processor = ImageProcessor(Config())
+        metadata = processor.get_cached_metadata(file_path)
         
-        print(f"缓存文件路径: {metadata_path}")
-        if os.path.exists(metadata_path):
-            with open(metadata_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+        if metadata is not None:
             cache_rating = metadata.get('rating', 0)
             print(f"缓存文件中的评分: {cache_rating}⭐")
             
@@ -43,7 +38,7 @@ def test_rating_functions(file_path):
             else:
                 print("✗ 缓存文件评分与实际评分不一致")
         else:
-            print("缓存文件不存在，尝试提取元数据...")
+            print("元数据缓存不存在，尝试提取元数据...")
             # 尝试提取元数据来创建缓存文件
             metadata = processor.extract_metadata(file_path)
             print(f"提取的元数据评分: {metadata.get('rating', 0)}⭐")
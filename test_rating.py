@@ -1,28 +1,36 @@
-import subprocess
+import atexit
 import sys
 from pathlib import Path
 
+from image_processor import ExifToolDaemon
+
 photo_path = Path(r"E:\测试目录\1\653A7189.jpg")
 
+# 常驻的exiftool进程，多次读写只启动一次Perl解释器
+_exiftool = ExifToolDaemon()
+atexit.register(_exiftool.close)
+
 def get_rating(file_path: Path) -> int:
-    result = subprocess.run(
-        ["exiftool", "-Rating", "-s3", str(file_path)],
-        capture_output=True, text=True, encoding="mbcs", errors="ignore"  # ← 修改
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"读取评级失败: {result.stderr.strip()}")
-    rating_str = result.stdout.strip()
-    return int(rating_str) if rating_str.isdigit() else 0
+    return _exiftool.read_ratings([str(file_path)])[str(file_path)]
 
 def set_rating(file_path: Path, stars: int):
     if stars < 0 or stars > 5:
         raise ValueError("星级必须是 0-5 之间的整数")
-    result = subprocess.run(
-        ["exiftool", f"-Rating={stars}", "-overwrite_original", str(file_path)],
-        capture_output=True, text=True, encoding="mbcs", errors="ignore"  # ← 修改
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"写入评级失败: {result.stderr.strip()}")
+    if not _exiftool.write_rating(str(file_path), stars):
+        raise RuntimeError(f"写入评级失败: {file_path}")
+
+def get_ratings_batch(paths: list[Path]) -> dict[Path, int]:
+    """用一条exiftool命令读取多个文件的评级"""
+    ratings = _exiftool.read_ratings([str(path) for path in paths])
+    return {path: ratings[str(path)] for path in paths}
+
+def set_ratings_batch(pairs: dict[Path, int]):
+    """批量写入评级，评级相同的文件用一条exiftool命令写入"""
+    if any(stars < 0 or stars > 5 for stars in pairs.values()):
+        raise ValueError("星级必须是 0-5 之间的整数")
+    updated = _exiftool.write_ratings({str(path): stars for path, stars in pairs.items()})
+    if updated < len(pairs):
+        raise RuntimeError(f"写入评级失败: {len(pairs) - updated} 个文件未更新")
 
 if __name__ == "__main__":
     current = get_rating(photo_path)
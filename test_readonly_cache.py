@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+from PIL import Image
+
+from config import Config
+from image_processor import ImageProcessor
+
+# 确保中文显示正常
+sys.stdout.reconfigure(encoding='utf-8')
+
+def test_readonly_folder(image_count=3):
+    """模拟无法创建缓存目录的只读文件夹，检查扫描仍能返回其中的图片"""
+    directory = tempfile.mkdtemp()
+    for index in range(image_count):
+        Image.new('RGB', (64, 48)).save(os.path.join(directory, f"{index}.jpg"))
+
+    real_makedirs = os.makedirs
+    def readonly_makedirs(path, *args, **kwargs):
+        if os.path.basename(path) == '.album_cache':
+            raise PermissionError(13, "Permission denied", path)
+        return real_makedirs(path, *args, **kwargs)
+
+    processor = ImageProcessor(Config())
+    try:
+        with mock.patch('os.makedirs', readonly_makedirs):
+            images = processor.scan_current_directory(directory)
+            print(f"扫描到 {len(images)} 张图片（共 {image_count} 张）")
+            if len(images) == image_count:
+                print("✓ 只读文件夹中的图片照常列出")
+            else:
+                print("✗ 只读文件夹中的图片没有全部列出")
+
+            metadata = processor.extract_metadata(os.path.join(directory, "0.jpg"))
+            print(f"提取的元数据: {metadata['filename']} {metadata['rating']}⭐")
+
+        if os.path.exists(os.path.join(directory, '.album_cache')):
+            print("✗ 创建了缓存目录")
+        return len(images) == image_count
+    finally:
+        processor._stop_workers()
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    if not test_readonly_folder():
+        sys.exit(1)
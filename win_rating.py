@@ -0,0 +1,78 @@
+"""通过Windows属性系统（IPropertyStore）读写图片的星级评分
+
+资源管理器显示的星级保存在System.Rating属性中（取值0-99），读写只需一次COM调用，
+不需要经过exiftool进程。只能在安装了pywin32的Windows上导入，其他平台导入时抛出ImportError
+"""
+
+import bisect
+import logging
+import threading
+from typing import Optional
+
+import pythoncom
+import winerror
+from win32com.propsys import propsys, pscon
+from win32com.shell import shellcon
+
+logger = logging.getLogger(__name__)
+
+# 写入时各星级对应的System.Rating值，与资源管理器一致
+STARS_TO_RATING = (0, 1, 25, 50, 75, 99)
+# 读取时System.Rating值的区间下限，资源管理器按区间显示星级：1-12为1星、13-37为2星……88-99为5星
+RATING_THRESHOLDS = (1, 13, 38, 63, 88)
+# 按System.Rating值（0-99）直接索引的星级表，由上面的区间预先计算
+STARS_BY_RATING = tuple(bisect.bisect_right(RATING_THRESHOLDS, value) for value in range(100))
+
+# 记录当前线程是否已初始化COM
+_com_state = threading.local()
+
+def _ensure_com():
+    """在当前线程初始化COM，每个线程只初始化一次
+    
+    线程已按单线程套间初始化过（如--rebuild-cache时的主线程）时CoInitializeEx返回RPC_E_CHANGED_MODE，
+    沿用已有的初始化即可，属性系统在两种套间中都可以使用
+    """
+    if not getattr(_com_state, 'initialized', False):
+        try:
+            pythoncom.CoInitializeEx(pythoncom.COINIT_MULTITHREADED)
+        except pythoncom.com_error as e:
+            if e.hresult != winerror.RPC_E_CHANGED_MODE:
+                raise
+        _com_state.initialized = True
+
+def rating_to_stars(value) -> Optional[int]:
+    """把System.Rating的值转换为0-5星，属性未设置（VT_EMPTY）时返回None"""
+    if value is None:
+        return None
+    return STARS_BY_RATING[min(max(int(value), 0), 99)]
+
+def read_rating(file_path: str) -> Optional[int]:
+    """读取图片的星级评分
+
+    Returns:
+        Optional[int]: 0-5星；文件没有设置System.Rating、格式没有属性处理程序或读取失败时返回None，
+        由调用方改用exiftool
+    """
+    try:
+        _ensure_com()
+        store = propsys.SHGetPropertyStoreFromParsingName(
+            file_path, None, shellcon.GPS_DEFAULT, propsys.IID_IPropertyStore)
+        value = store.GetValue(pscon.PKEY_Rating).GetValue()
+        return rating_to_stars(value)
+    except pythoncom.com_error as e:
+        logger.debug("属性系统读取评分失败 %s: %s", file_path, e)
+        return None
+
+def write_rating(file_path: str, stars: int) -> bool:
+    """写入图片的星级评分，格式不支持写入或写入失败时返回False，由调用方改用exiftool"""
+    try:
+        _ensure_com()
+        store = propsys.SHGetPropertyStoreFromParsingName(
+            file_path, None, shellcon.GPS_READWRITE, propsys.IID_IPropertyStore)
+        store.SetValue(pscon.PKEY_Rating,
+                       propsys.PROPVARIANTType(STARS_TO_RATING[stars], pythoncom.VT_UI4))
+        store.Commit()
+        return True
+    except pythoncom.com_error as e:
+        logger.debug("属性系统写入评分失败 %s: %s", file_path, e)
+        return False